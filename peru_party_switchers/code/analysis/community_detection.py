@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Community Detection Engine               |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Community detection on the sparse undirected adjacency of the party
+switching network. Besides Clauset-Newman-Moore (networkx), it implements
+Louvain modularity optimisation with a Leiden-style refinement (communities
+that are not internally connected are split) and label propagation. The
+methods run side by side in a process pool, and are compared by modularity,
+runtime and partition agreement (adjusted Rand index).
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import time
+import multiprocessing as mp
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+from networkx.algorithms import community as cm
+
+#  ________________________________________
+# |                                        |
+# |            2: Local Modules            |
+# |________________________________________|
+
+import sparse_graph as sg
+
+#  ________________________________________
+# |                                        |
+# |           3: Helper Functions          |
+# |________________________________________|
+
+def adjacency(P):
+    '''
+    Binary symmetric adjacency of an undirected networkx graph, keeping its
+    node order (and its self loops in the diagonal).
+
+    Input:
+        P: (nx.Graph) the graph
+    Output:
+        S: (sp.csr_matrix) adjacency matrix
+        nodes: (pd.Index) node of every row
+    '''
+    nodes = pd.Index(list(P))
+    n = len(nodes)
+    edges = list(P.edges())
+    if not edges:
+        return sp.csr_matrix((n, n)), nodes
+
+    u, v = zip(*edges)
+    r, c = nodes.get_indexer(u), nodes.get_indexer(v)
+    S = sp.csr_matrix((np.ones(len(r)), (r, c)), shape=(n, n))
+
+    return ((S + S.T) > 0).astype(float).tocsr(), nodes
+
+
+def drop_loops(S):
+    '''
+    Adjacency without the diagonal
+    '''
+    S = S.tolil()
+    S.setdiag(0)
+    S = S.tocsr()
+    S.eliminate_zeros()
+
+    return S
+
+
+def relabel_by_size(labels):
+    '''
+    Renumbers the communities from the largest (0) to the smallest, ties by
+    first appearance
+    '''
+    codes, _ = pd.factorize(labels)
+    sizes = np.bincount(codes)
+    order = np.argsort(-sizes, kind='stable')
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order))
+
+    return rank[codes]
+
+
+def adjusted_rand(a, b):
+    '''
+    Adjusted Rand index between two partitions, from their sparse
+    contingency table
+    '''
+    a, b = pd.factorize(a)[0], pd.factorize(b)[0]
+    n = len(a)
+    ct = sp.csr_matrix((np.ones(n), (a, b)))
+    ct.sum_duplicates()
+
+    def pairs(x):
+        return (x * (x - 1) / 2).sum()
+
+    sum_ij = pairs(ct.data)
+    sum_a = pairs(np.asarray(ct.sum(axis=1)).ravel())
+    sum_b = pairs(np.asarray(ct.sum(axis=0)).ravel())
+    expected = sum_a * sum_b / (n * (n - 1) / 2) if n > 1 else 0
+    maximum = (sum_a + sum_b) / 2
+    if maximum == expected:
+        return 1.0
+
+    return (sum_ij - expected) / (maximum - expected)
+
+#  ________________________________________
+# |                                        |
+# |          4: Louvain and Leiden         |
+# |________________________________________|
+
+def move_nodes(W, comm, order, resolution=1):
+    '''
+    Local moving phase: visits the nodes in order and moves each one to the
+    neighbouring community with the largest modularity gain, until a full
+    pass moves no node. Self loops (the internal weight of aggregated nodes)
+    count in the degrees but not in the gains.
+
+    Inputs:
+        W: (sp.csr_matrix) symmetric weighted adjacency
+        comm: (np.array) initial community of every node
+        order: (np.array) nodes to visit, in visiting order
+        resolution: (float) resolution of the modularity
+    Returns:
+        comm: (np.array) community of every node
+        moves: (int) number of moves made
+    '''
+    indptr, indices = W.indptr.tolist(), W.indices.tolist()
+    data = W.data.tolist()
+    k = np.asarray(W.sum(axis=1)).ravel()
+    m2 = k.sum()
+    comm = comm.tolist()
+    tot = np.bincount(comm, weights=k, minlength=len(comm)).tolist()
+    k = k.tolist()
+    if m2 == 0:
+        return np.array(comm), 0
+
+    moves, moved = 0, True
+    while moved:
+        moved = False
+        for i in order:
+            ci, ki = comm[i], k[i]
+            tot[ci] -= ki
+            w = {}
+            for p in range(indptr[i], indptr[i + 1]):
+                j = indices[p]
+                if j != i:
+                    w[comm[j]] = w.get(comm[j], 0) + data[p]
+            best = ci
+            best_gain = w.get(ci, 0) - resolution * ki * tot[ci] / m2
+            for c, wc in w.items():
+                gain = wc - resolution * ki * tot[c] / m2
+                if gain > best_gain:
+                    best, best_gain = c, gain
+            tot[best] += ki
+            if best != ci:
+                comm[i] = best
+                moves += 1
+                moved = True
+
+    return np.array(comm), moves
+
+
+def aggregate(W, comm):
+    '''
+    Graph of the communities: one node per community, with the total weight
+    between (and inside) them
+    '''
+    C = sp.csr_matrix((np.ones(len(comm)), (np.arange(len(comm)), comm)))
+
+    return (C.T @ W @ C).tocsr()
+
+
+def split_disconnected(S, labels):
+    '''
+    Leiden-style refinement: splits every community into its connected
+    components, so all communities are internally connected
+    '''
+    coo = S.tocoo()
+    keep = labels[coo.row] == labels[coo.col]
+    I = sp.csr_matrix((coo.data[keep], (coo.row[keep], coo.col[keep])),
+                      shape=S.shape)
+
+    return csgraph.connected_components(I, directed=False)[1]
+
+
+def optimise(W, resolution, rng):
+    '''
+    Louvain levels on a weighted adjacency (self loops are internal
+    weight): alternates the local moving phase and the aggregation of the
+    communities until no node moves.
+
+    Returns:
+        (np.array) community of every node of W
+    '''
+    member = np.arange(W.shape[0])
+    while True:
+        comm = np.arange(W.shape[0])
+        order = rng.permutation(W.shape[0]).tolist()
+        comm, moves = move_nodes(W, comm, order, resolution)
+        comm = np.unique(comm, return_inverse=True)[1]
+        member = comm[member]
+        if moves == 0 or comm.max() + 1 == W.shape[0]:
+            return member
+        W = aggregate(W, comm)
+
+
+def louvain(S, resolution=1, seed=None):
+    '''
+    Louvain modularity optimisation, followed by the split of the
+    disconnected communities.
+
+    Inputs:
+        S: (sp.csr_matrix) symmetric adjacency
+        resolution: (float) resolution of the modularity
+        seed: (int) seed of the node visiting order
+    Returns:
+        labels: (np.array) community of every node, 0 being the largest
+    '''
+    rng = np.random.default_rng(seed)
+    S = drop_loops(S)
+    member = optimise(S, resolution, rng)
+
+    return relabel_by_size(split_disconnected(S, member))
+
+
+def hierarchy(S, resolutions, seed=None):
+    '''
+    Nested multi-resolution communities. The finest level is optimised at
+    the highest resolution; every coarser level optimises the graph of the
+    communities of the previous one at the next lower resolution, so each
+    community splits exactly into communities of the finer levels.
+
+    Inputs:
+        S: (sp.csr_matrix) symmetric adjacency
+        resolutions: (list) resolutions of the levels
+        seed: (int) seed of the node visiting order
+    Returns:
+        levels: (list of tuples) (resolution, labels) from the coarsest to
+                the finest level, labels numbered by size
+    '''
+    rng = np.random.default_rng(seed)
+    S = drop_loops(S)
+    W = S
+    member = np.arange(S.shape[0])
+    levels = []
+    for i, resolution in enumerate(sorted(resolutions, reverse=True)):
+        comm = optimise(W, resolution, rng)
+        if i == 0:
+            comm = split_disconnected(S, comm)
+        member = comm[member]
+        levels.append((resolution, relabel_by_size(member)))
+        W = aggregate(S, member)
+
+    return levels[::-1]
+
+#  ________________________________________
+# |                                        |
+# |         5: Other Methods               |
+# |________________________________________|
+
+def label_propagation(S, seed=None):
+    '''
+    Asynchronous label propagation: every node takes the label with the
+    largest weight among its neighbours (local moving without the modularity
+    null term, on a single level).
+    '''
+    rng = np.random.default_rng(seed)
+    S = drop_loops(S)
+    n = S.shape[0]
+    comm, _ = move_nodes(S, np.arange(n), rng.permutation(n).tolist(),
+                         resolution=0)
+
+    return relabel_by_size(comm)
+
+
+def greedy_modularity(S, seed=None, nodes=None):
+    '''
+    Clauset-Newman-Moore greedy modularity maximization (networkx). The
+    graph is rebuilt with the original node names, since networkx breaks
+    ties by node, so the result matches running it on the networkx graph.
+    The labels follow the order of the communities returned by networkx
+    (largest first).
+    '''
+    if nodes is None:
+        nodes = pd.Index(range(S.shape[0]))
+    coo = sp.triu(S).tocoo()
+    P = nx.Graph()
+    P.add_nodes_from(nodes)
+    P.add_edges_from(zip(nodes[coo.row], nodes[coo.col]))
+
+    labels = np.zeros(S.shape[0], dtype=int)
+    for c_i, c in enumerate(cm.greedy_modularity_communities(P, weight=None)):
+        labels[nodes.get_indexer(list(c))] = c_i
+
+    return labels
+
+
+METHODS = {'cnm': greedy_modularity,
+           'louvain': louvain,
+           'label_propagation': label_propagation}
+
+#  ________________________________________
+# |                                        |
+# |              6: Workers                |
+# |________________________________________|
+
+WORKER_DATA = None #Adjacency matrix and node names shared by the workers
+
+
+def init_worker(S, nodes):
+    '''
+    Receives the adjacency matrix and node names once per worker
+    '''
+    global WORKER_DATA
+    WORKER_DATA = (S, nodes)
+
+
+def run_method(task):
+    '''
+    Runs one (method, seed) task and times it
+    '''
+    method, seed = task
+    S, nodes = WORKER_DATA
+    start = time.time()
+    if method == 'cnm':
+        labels = greedy_modularity(S, nodes=nodes)
+    else:
+        labels = METHODS[method](S, seed=seed)
+
+    return labels, time.time() - start
+
+
+def run_tasks(S, tasks, processes=None, nodes=None):
+    '''
+    Runs (method, seed) tasks in a process pool sharing the adjacency.
+    processes defaults to the number of CPUs, 1 runs in this process.
+    Returns the (labels, seconds) of every task, in order.
+    '''
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = min(processes, len(tasks))
+
+    if processes <= 1:
+        init_worker(S, nodes)
+        return [run_method(t) for t in tasks]
+
+    with mp.Pool(processes, initializer=init_worker,
+                 initargs=(S, nodes)) as pool:
+        return pool.map(run_method, tasks)
+
+#  ________________________________________
+# |                                        |
+# |            7: Comparison               |
+# |________________________________________|
+
+def compare_methods(S, methods=('cnm', 'louvain', 'label_propagation'),
+                    processes=None, seed=1234, nodes=None):
+    '''
+    Runs the community detection methods, each in its own worker, and
+    compares their partitions.
+
+    Inputs:
+        S: (sp.csr_matrix) symmetric adjacency (see adjacency)
+        methods: (tuple) names of the methods in METHODS
+        processes: (int) number of workers (see run_tasks)
+        seed: (int) seed of the randomized methods
+        nodes: (pd.Index) node of every row, used by CNM to break ties as
+               networkx does on the original graph
+    Returns:
+        partitions: (dict) labels of every node by method
+        report: (pd.DataFrame) communities, modularity and runtime (seconds)
+                by method
+        agreement: (pd.DataFrame) adjusted Rand index between the methods
+    '''
+    tasks = [(method, seed) for method in methods]
+    results = run_tasks(S, tasks, processes, nodes)
+
+    partitions = {m: r[0] for m, r in zip(methods, results)}
+    S = drop_loops(S)
+    report = pd.DataFrame({
+        'communities': [r[0].max() + 1 for r in results],
+        'modularity': [sg.modularity(S, r[0]) for r in results],
+        'seconds': [r[1] for r in results]}, index=list(methods))
+
+    agreement = pd.DataFrame(
+        [[adjusted_rand(partitions[a], partitions[b]) for b in methods]
+         for a in methods], index=list(methods), columns=list(methods))
+
+    return partitions, report, agreement
+
+#  ________________________________________
+# |                                        |
+# |            8: Consensus                |
+# |________________________________________|
+
+def consensus(S, method='louvain', runs=50, processes=None, seed=1234,
+              threshold=0.5):
+    '''
+    Consensus clustering: runs a randomized method with many seeds in
+    parallel and builds the co-assignment matrix, the share of the runs that
+    put the two ends of every edge in the same community (kept sparse on the
+    edges of the network). Co-assignments below the threshold are dropped
+    and the method is run once more on the weighted co-assignment graph to
+    get the final partition.
+
+    Inputs:
+        S: (sp.csr_matrix) symmetric adjacency (see adjacency)
+        method: (str) randomized method in METHODS
+        runs: (int) number of seeds
+        processes: (int) number of workers (see run_tasks)
+        seed: (int) seed generating the seeds of the runs
+        threshold: (float) minimum co-assignment kept
+    Returns:
+        labels: (np.array) consensus community of every node
+        stability: (np.array) average over the runs of the Jaccard similarity
+                   between the community of every node in the run and its
+                   consensus community
+        D: (sp.csr_matrix) co-assignment matrix on the edges
+    '''
+    seeds = np.random.SeedSequence(seed).generate_state(runs).tolist()
+    results = run_tasks(S, [(method, s) for s in seeds], processes)
+
+    coo = drop_loops(S).tocoo()
+    L = np.vstack([r[0] for r in results])
+    same = (L[:, coo.row] == L[:, coo.col]).mean(axis=0)
+
+    n = S.shape[0]
+    D = sp.csr_matrix((same, (coo.row, coo.col)), shape=(n, n))
+    kept = sp.csr_matrix((np.where(same >= threshold, same, 0),
+                          (coo.row, coo.col)), shape=(n, n))
+    kept.eliminate_zeros()
+    labels = METHODS[method](kept, seed=seed)
+
+    size = np.bincount(labels)
+    stability = np.zeros(n)
+    for run in L:
+        ct = sp.csr_matrix((np.ones(n), (run, labels)))
+        ct.sum_duplicates()
+        both = np.asarray(ct[run, labels]).ravel()
+        stability += both / (np.bincount(run)[run] + size[labels] - both)
+    stability /= runs
+
+    return labels, stability, D
+
+#  ________________________________________
+# |                                        |
+# |            9: Warm Start               |
+# |________________________________________|
+
+def neighbourhood(S, touched):
+    '''
+    Touched nodes and their neighbours, as a boolean mask
+    '''
+    return touched | (S @ touched.astype(float) > 0)
+
+
+def refine(S, labels, movable, resolution=1):
+    '''
+    Warm start: runs the local moving phase from a previous partition,
+    visiting only the movable nodes, so untouched parts of the network keep
+    their communities.
+
+    Inputs:
+        S: (sp.csr_matrix) symmetric adjacency
+        labels: (np.array) previous community of every node
+        movable: (np.array) boolean mask of the nodes that can move
+        resolution: (float) resolution of the modularity
+    Returns:
+        labels: (np.array) refined community of every node, with the same
+                labels as the input
+        moves: (int) number of moves made
+    '''
+    codes, uniques = pd.factorize(labels)
+    order = np.flatnonzero(movable).tolist()
+    comm, moves = move_nodes(drop_loops(S), codes, order, resolution)
+
+    return np.asarray(uniques)[comm], moves
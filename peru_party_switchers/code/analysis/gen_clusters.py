@@ -23,10 +23,12 @@ the community (clusters) id's
 
 
 import pandas as pd
+import numpy as np
 import networkx as nx
 from networkx.algorithms import community as cm
 import os, sys
 import sqlite3
+import time
 
 
 #  ________________________________________
@@ -38,6 +40,8 @@ import queries as q
 import db_config as db
 import network_structure as ns 
 import party_switching as ps 
+import community_detection as cd
+import sparse_graph as sg
 
 #  ________________________________________
 # |                                        |
@@ -47,17 +51,35 @@ import party_switching as ps
 os.chdir(ps.wd)
 sys.path.append(os.chdir(ps.wd))
 
+#Globals
+CLUSTER_METHOD = 'cnm' #Partition written to nodes.clusters (see cd.METHODS)
+CONSENSUS_RUNS = 50 #Seeds of the consensus of the randomized methods
+DRIFT_THRESHOLD = 0.01 #Modularity loss that triggers a full re-clustering
+CLUSTER_STATE = 'data/db/cluster_state.db' #Kept apart from db_config rebuilds
+RESOLUTIONS = [0.5, 1, 2, 4, 8] #Levels of the community hierarchy
+
 
 #  ________________________________________
 # |                                        |
 # |          4: Cluster Analysis           |
 # |________________________________________|
 
-def cluster_analysis():
+def cluster_analysis(method=CLUSTER_METHOD, methods=tuple(cd.METHODS),
+                     processes=None, runs=CONSENSUS_RUNS):
     '''
-    Identifies communities in the network using 
-    Clauset-Newman-Moore greedy modularity maximization.
-    The biggest community was pationed using the Kernighan–Lin algorithm
+    Identifies communities in the network. The community detection methods
+    (Clauset-Newman-Moore greedy modularity maximization, Louvain and label
+    propagation) run in parallel and are compared, and the partition of
+    the chosen method is kept. For the randomized methods, the kept
+    partition is the consensus of runs seeds, with the stability of every
+    node.
+    With CNM, the biggest community is partitioned using the Kernighan–Lin
+    algorithm
+    Input:
+        method: (str) method whose partition is kept
+        methods: (tuple) methods to run and compare
+        processes: (int) number of workers (see cd.run_tasks)
+        runs: (int) seeds of the consensus. 1 keeps the single run
     Output:
         df_n: nodes dataframe with cluster id's and cluster lables
         DG: Fiuill Directed NEtwork
@@ -66,20 +88,40 @@ def cluster_analysis():
                                           q.all_nodes, graph = nx.DiGraph)
     P = DG.to_undirected()
 
-    # Clauset-Newman-Moore greedy modularity maximization
-    gmc = cm.greedy_modularity_communities(P, weight=None)
+    S, nodes = cd.adjacency(P)
+    if method not in methods:
+        methods = tuple(methods) + (method,)
+    partitions, report, agreement = cd.compare_methods(S, methods, processes,
+                                                   nodes=nodes)
+    print(report.round(4))
+    print()
+    print('Partition agreement (adjusted Rand index)')
+    print(agreement.round(3))
+    print()
+
+    if method != 'cnm' and runs > 1:
+        labels, stability, _ = cd.consensus(S, method, runs, processes)
+        partitions[method] = labels
+        df_n.loc[nodes, 'stability'] = stability
+        print('Consensus of {} runs: {} communities, mean stability {:.3f}'\
+              .format(runs, labels.max() + 1, stability.mean()))
+        print()
 
-    c_i = 0
     df_n['cluster_gmc'] = 0
-    for c in gmc:
-        df_n.loc[list(c), 'cluster_gmc'] = c_i
-        c_i +=1
-    #Kernighan–Lin algorithm on the biggest community
-    klb = cm.kernighan_lin_bisection(P.subgraph(list(gmc[0])), seed=1234)
-    c_i = 0
-    for c in klb:
-        df_n.loc[list(c), 'cluster_klb'] = c_i
-        c_i +=1 
+    df_n.loc[nodes, 'cluster_gmc'] = partitions[method]
+
+    if method == 'cnm':
+        #Kernighan–Lin algorithm on the biggest community
+        gmc_0 = list(nodes[partitions[method] == 0])
+        #Unweighted, as the greedy modularity clusters (weight=None)
+        klb = cm.kernighan_lin_bisection(P.subgraph(gmc_0), weight=None,
+                                         seed=1234)
+        c_i = 0
+        for c in klb:
+            df_n.loc[list(c), 'cluster_klb'] = c_i
+            c_i +=1 
+    else:
+        df_n['cluster_klb'] = np.nan
 
     df_n['cluster_klb'] = df_n['cluster_klb'].fillna(2).astype(int)
     df_n['clusters'] = pd.factorize(df_n.cluster_gmc*100 + \
@@ -88,6 +130,12 @@ def cluster_analysis():
     #Merging the smaller commnunities
     df_n.loc[df_n.clusters >= 12, 'clusters' ] = 12
 
+    if method != 'cnm':
+        # The labels below describe the CNM communities
+        df_n['cluster_labs'] = 'Community ' + (df_n.clusters + 1).astype(str)
+        df_n.loc[df_n.clusters == 12, 'cluster_labs'] = 'Other Local Movements'
+        return df_n, DG
+
     # Labelling the communities according to the underlying characteristic
     df_n.loc[df_n.clusters == 0, 'cluster_labs'] = 'Strong Regional Left' 
     df_n.loc[df_n.clusters == 1, 'cluster_labs'] = 'Socialist Progresive + AP' 
@@ -106,7 +154,176 @@ def cluster_analysis():
 
 #  ________________________________________
 # |                                        |
-# |            5: Degree Measures          |
+# |         5: Incremental Clusters        |
+# |________________________________________|
+
+def edge_pairs(S, names):
+    '''
+    Undirected edges of the adjacency as (source, target) party name pairs,
+    with source <= target
+    '''
+    coo = S.tocoo()
+    u, v = names[coo.row], names[coo.col]
+    keep = u <= v
+
+    return pd.DataFrame({'source': u[keep], 'target': v[keep]})
+
+
+def previous_state():
+    '''
+    Edges, clusters and modularity of the last full clustering, None if
+    there is no clustering state yet. The state is kept in CLUSTER_STATE,
+    by party name, so it outlives the rebuilds of the database.
+    '''
+    if not os.path.exists(CLUSTER_STATE):
+        return None
+    conn = sqlite3.connect(CLUSTER_STATE)
+    tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table'",
+                         conn)['name'].tolist()
+    if not {'cluster_edges', 'cluster_nodes', 'cluster_quality'} <= \
+           set(tables):
+        conn.close()
+        return None
+
+    edges = pd.read_sql('SELECT source, target FROM cluster_edges', conn)
+    clusters = pd.read_sql('SELECT p_name, clusters, cluster_labs FROM '
+                           'cluster_nodes', conn).set_index('p_name')
+    quality = pd.read_sql('SELECT modularity FROM cluster_quality', conn)
+    conn.close()
+
+    return edges, clusters, quality['modularity'].iloc[0]
+
+
+def save_state(df_n, DG):
+    '''
+    Stores the edges, clusters and modularity of a full clustering in
+    CLUSTER_STATE, as the reference of the incremental updates
+    '''
+    S, nodes = cd.adjacency(DG.to_undirected())
+    labels = df_n['clusters'].reindex(nodes).values
+    quality = pd.DataFrame({'modularity':
+                            [sg.modularity(cd.drop_loops(S), labels)]})
+    names = df_n['p_name'].reindex(nodes).values
+
+    conn = sqlite3.connect(CLUSTER_STATE)
+    edge_pairs(S, names).to_sql('cluster_edges', conn,
+                                if_exists = 'replace', index = False)
+    df_n[['p_name', 'clusters', 'cluster_labs']].to_sql('cluster_nodes', conn,
+                                    if_exists = 'replace', index = False)
+    quality.to_sql('cluster_quality', conn, if_exists = 'replace',
+                   index = False)
+    conn.commit()
+    conn.close()
+
+
+def incremental_analysis(threshold=DRIFT_THRESHOLD):
+    '''
+    Warm-start re-clustering: starts from the clusters of the last full
+    clustering (matched by party name) and only lets the nodes touched by edges added or removed since the last
+    full clustering (and their neighbours) change community. New nodes that
+    do not join an existing community go to 'Other Local Movements'.
+    Input:
+        threshold: (float) modularity loss, with respect to the last full
+                   clustering, above which the warm start is rejected
+    Output:
+        df_n: nodes dataframe with cluster id's and cluster lables, None if
+              a full clustering is needed
+        DG: Full Directed Network
+    '''
+    start = time.time()
+    DG, _, df_n = ns.network_structure(db.db_file, q.all_network, \
+                                          q.all_nodes, graph = nx.DiGraph)
+    state = previous_state()
+    if state is None:
+        print('No previous clustering, running a full clustering')
+        return None, DG
+    old_edges, old_clusters, old_quality = state
+
+    S, nodes = cd.adjacency(DG.to_undirected())
+    names = df_n['p_name'].reindex(nodes).values
+    diff = edge_pairs(S, names).merge(old_edges, how='outer', indicator=True)
+    diff = diff.loc[diff['_merge'] != 'both']
+
+    labels = old_clusters['clusters'].reindex(names).values.astype(float)
+    new = np.isnan(labels)
+    labels[new] = -1 - np.arange(new.sum()) #New nodes start alone
+    touched = np.isin(names, diff[['source', 'target']].values.ravel()) | new
+
+    movable = cd.neighbourhood(S, touched)
+    labels, moves = cd.refine(S, labels, movable)
+    labels[labels < 0] = 12
+    quality = sg.modularity(cd.drop_loops(S), labels)
+
+    print('Warm start: {} changed edges, {} nodes refined, {} moves, '\
+          'modularity {:.4f} (full clustering {:.4f}), {:.3f}s'.format(
+          len(diff), movable.sum(), moves, quality,
+          old_quality, time.time() - start))
+    if old_quality - quality > threshold:
+        print('Modularity drifted more than {}, running a full clustering'\
+              .format(threshold))
+        return None, DG
+
+    labs = old_clusters.groupby('clusters')['cluster_labs'].first()
+    labs[12] = 'Other Local Movements'
+    df_n.loc[nodes, 'clusters'] = labels.astype(int)
+    df_n['cluster_labs'] = df_n['clusters'].map(labs)
+
+    return df_n, DG
+
+#  ________________________________________
+# |                                        |
+# |         6: Community Hierarchy         |
+# |________________________________________|
+
+def community_levels(DG, resolutions=RESOLUTIONS, seed=1234):
+    '''
+    Computes the nested multi-resolution communities once and stores them
+    in the community_levels table (one row per level and node). Level 0 is
+    the coarsest.
+    Input:
+        DG: Full Directed Network
+        resolutions: (list) modularity resolution of every level
+        seed: (int) seed of the Louvain node order
+    Output:
+        df_l: (pd.DataFrame) level, resolution, node and cluster
+    '''
+    S, nodes = cd.adjacency(DG.to_undirected())
+    levels = cd.hierarchy(S, resolutions, seed)
+    df_l = pd.concat([pd.DataFrame({'level': i, 'resolution': r,
+                                    'node': nodes, 'cluster': labels})
+                      for i, (r, labels) in enumerate(levels)],
+                     ignore_index=True)
+
+    conn = sqlite3.connect(db.db_file)
+    df_l.to_sql('community_levels', conn, if_exists = 'replace',
+                index = False)
+    conn.execute('CREATE INDEX idx_community_levels ON '
+                 'community_levels (level, node)')
+    conn.commit()
+    conn.close()
+
+    for i, (r, labels) in enumerate(levels):
+        print('Level {} (resolution {}): {} communities'.format(
+              i, r, labels.max() + 1))
+    print()
+
+    return df_l
+
+
+def level_clusters(level):
+    '''
+    Node to cluster mapping of a level of the community hierarchy, read
+    from the community_levels table
+    '''
+    conn = sqlite3.connect(db.db_file)
+    df = pd.read_sql(q.community_level.format(int(level)), conn)
+    conn.close()
+
+    return df.set_index('node')['cluster']
+
+#  ________________________________________
+# |                                        |
+# |            7: Degree Measures          |
 # |________________________________________|
 
 def neighbor_degree(DG, df_n):
@@ -119,28 +336,48 @@ def neighbor_degree(DG, df_n):
 
 #  ________________________________________
 # |                                        |
-# |              6: DB Update              |
+# |              8: DB Update              |
 # |________________________________________|
 
-def update_db(df_n):
+def update_db(df_n, DG=None):
     '''
-    Updating the database with node table with the communities (clusters)
+    Updating the database with node table with the communities (clusters).
+    After a full clustering (DG given), also stores its state as the
+    reference of the incremental updates (see save_state).
     '''
     conn = sqlite3.connect(db.db_file)
 
-    df_n = df_n.drop(['cluster_gmc','cluster_klb'], axis=1)
+    df_n = df_n.drop(['cluster_gmc','cluster_klb'], axis=1, errors='ignore')
     df_n.to_sql('nodes', conn, if_exists = 'replace', index = True)
 
+    conn.close()
+    ns.invalidate_cache(db.db_file)
+
+    if DG is not None:
+        save_state(df_n, DG)
+
 
 #  ________________________________________
 # |                                        |
-# |               7: Wrapper               |
+# |               9: Wrapper               |
 # |________________________________________|
 
-def gen_clusters():
+def gen_clusters(incremental=False):
     '''
-    Commnunity analysis and database update process
+    Commnunity analysis and database update process. With incremental, the
+    previous clusters are refined where the network changed, and the full
+    analysis only runs if the modularity drifts too much. The community
+    hierarchy is rebuilt with every full analysis.
     '''
-    df_n, DG = cluster_analysis()
-    df_n = neighbor_degree(DG, df_n)
-    update_db(df_n)
\ No newline at end of file
+    df_n = None
+    if incremental:
+        df_n, DG = incremental_analysis()
+
+    if df_n is None:
+        df_n, DG = cluster_analysis()
+        df_n = neighbor_degree(DG, df_n)
+        update_db(df_n, DG)
+        community_levels(DG)
+    else:
+        df_n = neighbor_degree(DG, df_n)
+        update_db(df_n)
\ No newline at end of file
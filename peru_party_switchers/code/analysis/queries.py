@@ -32,6 +32,9 @@ FROM
     nodes
 """
 
+#Queries over whole tables are valid by construction and skip validation
+trusted = [all_network, all_nodes]
+
 add_clusters = \
 """
 ALTER TABLE nodes ADD COLUMN clusters INTEGER
@@ -104,6 +107,95 @@ GROUP BY
 """
 
 
+#Community graph at a level of the community hierarchy (format with the level)
+com_network_level = \
+"""
+SELECT
+     b.cluster as source
+    ,c.cluster as target
+    ,SUM(a.edge) as weight
+FROM
+    network a
+    JOIN
+    community_levels b
+        ON b.node = a.source AND b.level = {0}
+    JOIN
+    community_levels c
+        ON c.node = a.target AND c.level = {0}
+GROUP BY b.cluster, c.cluster
+"""
+
+com_nodes_level = \
+"""
+SELECT
+     cluster as node
+    ,'Community ' || (cluster + 1) as cluster_labs
+FROM
+    community_levels
+WHERE
+    level = {}
+GROUP BY
+    cluster
+"""
+
+community_level = \
+"""
+SELECT
+     node
+    ,cluster
+FROM
+    community_levels
+WHERE
+    level = {}
+"""
+
+#Coordinates laid out by a level of the community hierarchy (format with the
+#level)
+level_coords = \
+"""
+SELECT
+     node
+    ,cluster
+    ,clu_x
+    ,clu_y
+    ,ini_x
+    ,ini_y
+FROM
+    level_coordinates
+WHERE
+    level = {}
+"""
+
+com_nodes_level_coords = \
+"""
+SELECT
+     cluster as node
+    ,'Community ' || (cluster + 1) as cluster_labs
+    ,clu_x
+    ,clu_y
+FROM
+    level_coordinates
+WHERE
+    level = {}
+GROUP BY
+    cluster, clu_x, clu_y
+"""
+top_centrality = \
+"""
+SELECT
+     party_name
+    ,in_degree
+    ,out_degree
+    ,betweeness
+    ,eigenvector
+    ,pagerank
+FROM
+    node_metrics
+ORDER BY
+    {} DESC, node
+LIMIT {}
+"""
+
 candidates = \
 """
 SELECT
@@ -128,3 +220,41 @@ FROM
         org_pol) b
         ON a.org_pol = b.org_pol
 """
+
+candidate_names = \
+"""
+SELECT
+     id_hdv
+    ,name
+FROM
+    candidate_menu
+GROUP BY
+    id_hdv
+"""
+
+candidate_moves = \
+"""
+SELECT
+     id_hdv
+    ,year
+    ,p_name
+    ,type
+FROM
+    edges
+"""
+
+#Sankey flows of several parties (format with the comma separated parties)
+sankey_parties = \
+"""
+SELECT
+     party
+    ,direction
+    ,counterpart
+    ,attribute
+    ,attr_value
+    ,count
+FROM
+    sankey_flows
+WHERE
+    party IN ({})
+"""
@@ -143,3 +143,60 @@ def gen_sankey_vars(db_loc):
     sankey_vars.to_sql('sankey_vars', conn, if_exists='replace', index=False)
     conn.commit()
     conn.close()
+
+
+#  ________________________________________
+# |                                        |
+# |            3: The Flow Cube            |
+# |________________________________________|
+
+
+def gen_flow_cube(db_loc, attributes):
+    '''
+    CAUTION: THIS FUNCTION GENERATES A NEW TABLE IN DB AND REPLACES PREVIOUS
+    DB WITH THE SAME NAME
+    Materializes the party switching flows into and out of every party, split
+    by every sankey attribute, in a single grouped pass. The single party
+    analysis then only reads its slice of the table.
+    Input:
+        db_loc: database location
+        attributes: sankey attribute names ('None' for no attribute)
+    Output: None
+    '''
+
+    attributes = [a for a in attributes if a not in ['None', None]]
+
+    conn = sqlite3.connect(db_loc)
+    cursor = conn.cursor()
+
+    query = ('SELECT n.source, n.target, ' + \
+             ', '.join(['sv.{}'.format(a) for a in attributes]) + \
+             ' FROM network as n JOIN candidate as c on n.id_hdv = c.id_hdv '
+             'JOIN sankey_vars as sv on sv.id_hdv = c.id_hdv;')
+    moves = pd.read_sql(query, conn)
+    moves['None'] = 0
+
+    # One row per move and attribute
+    moves = moves.melt(id_vars=['source', 'target'], var_name='attribute', \
+                       value_name='attr_value')
+    moves = moves.dropna(subset=['attr_value'])
+    # melt leaves an object column (stored as TEXT): the attributes are numeric
+    moves['attr_value'] = pd.to_numeric(moves['attr_value'])
+
+    # Every move is an inflow of the target and an outflow of the source
+    inflow = moves.rename(columns={'target': 'party', 'source': 'counterpart'})
+    inflow['direction'] = 'in'
+    outflow = moves.rename(columns={'source': 'party', 'target': 'counterpart'})
+    outflow['direction'] = 'out'
+
+    cube = pd.concat([inflow, outflow], ignore_index=True, sort=True)
+    cube = cube.loc[cube['party'] != cube['counterpart']]
+    cube = cube.groupby(['party', 'direction', 'counterpart', 'attribute', \
+                         'attr_value']).size().reset_index(name='count')
+
+    #### Update db and close connection
+    cube.to_sql('sankey_flows', conn, if_exists='replace', index=False)
+    cursor.execute('CREATE INDEX idx_sankey_flows ON sankey_flows '
+                   '(party, attribute);')
+    conn.commit()
+    conn.close()
@@ -19,9 +19,8 @@ Computes various network metrics
 # |________________________________________|
 
 import sys, os
-import networkx as nx
-from operator import itemgetter
 import pandas as pd
+import sqlite3
 
 #  ________________________________________
 # |                                        |
@@ -30,6 +29,10 @@ import pandas as pd
 
 import party_switching as ps
 import network_structure as ns
+import sparse_graph as sg
+import betweenness as bt
+import spectral as spc
+import network_summary as nsum
 import queries as q
 import db_config as db
 
@@ -44,114 +47,60 @@ sys.path.append(os.chdir(ps.wd))
 
 #  ________________________________________
 # |                                        |
-# |           2: Helper Funcions           |
+# |           3: Centrality Table          |
 # |________________________________________|
 
+CENTRALITY_COLUMNS = ["in_degree", "out_degree", "betweeness", "eigenvector",
+                      "pagerank"]
 
-def display_info(G):
-    '''Display the basic information about the network'''
 
-    print(nx.info(G))
-
-
-def display_density(G):
-    '''Display the density of the network'''
-
-    print("Network Density: ", nx.density(G))
-
-
-def display_transitivity(G):
-    '''Display the transitivity of the network'''
-
-    print("Network Transitivity: ", nx.transitivity(G))
-
-def set_out_degree(G):
-    '''Calculate the out degree for each node and add it as a node attribute'''
-
-    out_degree_dict = dict(G.out_degree(G.nodes))
-    nx.set_node_attributes(G, out_degree_dict, "out_degree")
-
-    return out_degree_dict
-
-
-def set_in_degree(G):
-    '''Calculate the in degree for each node and add it as a node attribute'''
-
-    in_degree_dict = dict(G.in_degree(G.nodes))
-    nx.set_node_attributes(G, in_degree_dict, "in_degree")
-
-    return in_degree_dict
-
-
-def set_betweeness_centrality(G):
-    '''
-    Calculate the betweeness centrality for each node and add it as a node
-    attribute
-    '''
-
-    betweeness_dict = nx.betweenness_centrality(G)
-    nx.set_node_attributes(G, betweeness_dict, 'betweeness_centrality')
-
-    return betweeness_dict
-
-
-def set_eigenvector_centrality(G):
+def gen_node_metrics(processes=None, pivots=None):
     '''
-    Calculate the eigenvector centrality for each node and add it as a node
-    attribute
+    Computes every centrality measure once, on the sparse backend, and stores
+    them in the node_metrics table with an index on each measure.
+    Betweenness runs in a process pool; with pivots it is approximated from
+    that many sampled sources (see betweenness.betweenness_centrality).
+    Eigenvector centrality and PageRank come from the spectral engine.
     '''
 
-    eigenvector_dict = nx.eigenvector_centrality(G)
-    nx.set_node_attributes(G, eigenvector_dict, "eigenvector_centrality")
-
-    return eigenvector_dict
-
-#  ________________________________________
-# |                                        |
-# |           3: Compare Centrality        |
-# |________________________________________|
-
-def compare_centrality(G, order_by="in_degree"):
-    '''Compare the centrality measures of each node'''
-
-    in_degree = "in_degree"
-    out_degree = "out_degree"
-    betweeness = "betweeness"
-    eigenvector = "eigenvector"
-    party = "party_name"
-    column_names = [party, in_degree, out_degree, betweeness, eigenvector]
-
-    assert order_by in column_names
-
-    in_degree_dict = set_in_degree(G)
-    out_degree_dict = set_out_degree(G)
-    betweeness_dict = set_betweeness_centrality(G)
-    eigenvector_dict = set_eigenvector_centrality(G)
-
-    if order_by == in_degree:
-        top_nodes = sorted(in_degree_dict.items(), key=itemgetter(1),
-                           reverse=True)[:10]
-    elif order_by == out_degree:
-        top_nodes = sorted(out_degree_dict.items(), key=itemgetter(1),
-                           reverse=True)[:10]
-    elif order_by == betweeness:
-        top_nodes = sorted(betweeness_dict.items(), key=itemgetter(1),
-                           reverse=True)[:10]
-    else:
-        top_nodes = sorted(eigenvector_dict.items(), key=itemgetter(1),
-                           reverse=True)[:10]
-
-    tuples = []
-
-    for node, _ in top_nodes:
-        party = G.nodes[node]['p_name']
-        in_deg = in_degree_dict[node]
-        out_deg = out_degree_dict[node]
-        between = betweeness_dict[node]
-        eigvec = eigenvector_dict[node]
-        tuples.append((party, in_deg, out_deg, between, eigvec))
-
-    df = pd.DataFrame(tuples, columns=column_names)
+    G = ns.network_structure(db.db_file, q.all_network, q.all_nodes,
+                             graph=sg.SparseGraph)[0]
+
+    df = pd.DataFrame({'party_name': G.node_attrs['p_name'].values,
+                       'in_degree': G.degree_array('in'),
+                       'out_degree': G.degree_array('out')},
+                      index=G.node_index)
+    betweeness_dict, eps = bt.betweenness_centrality(G, processes, pivots)
+    df['betweeness'] = pd.Series(betweeness_dict)
+    if eps:
+        print("Approximate betweeness centrality: error bound", eps)
+    eigenvector_dict, info = spc.eigenvector_centrality(G)
+    df['eigenvector'] = pd.Series(eigenvector_dict)
+    if not info['converged']:
+        print("Eigenvector centrality did not converge:", info)
+    pagerank_dict, info = spc.pagerank(G)
+    df['pagerank'] = pd.Series(pagerank_dict)
+    if not info['converged']:
+        print("PageRank did not converge:", info)
+    df.index.name = 'node'
+
+    conn = sqlite3.connect(db.db_file)
+    df.to_sql('node_metrics', conn, if_exists='replace', index=True)
+    for col in CENTRALITY_COLUMNS:
+        conn.execute('CREATE INDEX idx_node_metrics_{0} ON node_metrics ({0})'.
+                     format(col))
+    conn.commit()
+    conn.close()
+
+
+def compare_centrality(order_by="in_degree", top=10):
+    '''Compare the centrality measures of the top nodes'''
+
+    assert order_by in CENTRALITY_COLUMNS
+
+    conn = sqlite3.connect(db.db_file)
+    df = pd.read_sql(q.top_centrality.format(order_by, top), conn)
+    conn.close()
 
     return df
 
@@ -165,25 +114,24 @@ def display_network_metrics(in_degree):
     Display network metrics on the user interface
     '''
 
-    rv = ns.network_structure(db.db_file, q.all_network, q.all_nodes,
-                                   graph=nx.DiGraph)
-    G = rv[0]
+    summary, _, _ = nsum.network_summary(db.db_file)
 
-    G.name = "Party-Switching"
     print("########## NETWORK METRICS ##########")
     print()
-    display_info(G)
+    print("Name: Party-Switching")
+    print(summary.loc[['Number of nodes', 'Number of edges',
+                       'Average in degree', 'Average out degree']])
     print()
     print("-------------------------------------")
     print("########## Connectivity ##########")
     print()
-    display_density(G)
-    display_transitivity(G)
+    print(summary.drop(['Number of nodes', 'Number of edges',
+                        'Average in degree', 'Average out degree']))
     print()
     print("########## Centrality Comparison ##########")
     print()
     print("Nodes ordered by", in_degree)
     print("-------------------------------------")
     print()
-    df = compare_centrality(G, order_by=in_degree)
+    df = compare_centrality(order_by=in_degree)
     print(df)
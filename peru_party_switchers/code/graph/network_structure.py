@@ -23,6 +23,7 @@ must output the intermediate pandas dataframe and the networkx object at demand.
 
 import os, sys
 import networkx as nx
+import numpy as np
 import pandas as pd
 import sqlite3
 
@@ -34,6 +35,8 @@ import sqlite3
 
 import party_switching as ps
 import db_config as db
+import queries as q
+import sparse_graph as sg
 
 #  ________________________________________
 # |                                        |
@@ -45,6 +48,12 @@ os.chdir(ps.wd)
 sys.path.append(os.chdir(ps.wd))
 db_dile = db.db_file
 
+#Globals
+EDGE_KEYS = ['id_hdv', 'source', 'target', 'year']
+NODE_KEYS = ['node']
+KEY_INDEX = {} #Hashed keys of network and nodes, by database version
+GRAPH_CACHE = {} #Built graphs and dataframes, by database version and query
+
 #  ________________________________________
 # |                                        |
 # |           4: Helper Functions          |
@@ -66,6 +75,86 @@ def get_header(cursor):
     return header
 
 
+def db_version(db_file):
+    """
+    Identifies the current version of a database file by its path, size and
+    last modification time
+    """
+
+    stat = os.stat(db_file)
+
+    return (os.path.abspath(db_file), stat.st_size, stat.st_mtime_ns)
+
+
+def hash_keys(df, keys):
+    """
+    Hashes the key columns of every row. Numeric keys are hashed as floats so
+    that, as in a merge, 2020 and 2020.0 are the same key.
+
+    :param df: (pd.DataFrame) contains the key columns
+    :param keys: (list of strings) key columns
+
+    :return: (np.array) one uint64 hash per row
+    """
+
+    key_df = df[keys].copy()
+    for k in keys:
+        if pd.api.types.is_numeric_dtype(key_df[k]):
+            key_df[k] = key_df[k].astype(float)
+        else:
+            key_df[k] = key_df[k].astype(str)
+
+    return pd.util.hash_pandas_object(key_df, index=False).values
+
+
+def key_index(c, edge=True):
+    """
+    Retrieves the hashed keys of the network or nodes table. The index is
+    built once per database version and cached in KEY_INDEX.
+
+    :param c: (cursor object)
+    :param edge: (bool) If True, index of the network table. If False, index
+                 of the nodes table
+
+    :return: (np.array) sorted unique hashed keys
+    """
+
+    if edge:
+        table, keys = 'network', EDGE_KEYS
+    else:
+        table, keys = 'nodes', NODE_KEYS
+
+    db_file = c.execute('PRAGMA database_list').fetchone()[2]
+    version = db_version(db_file)
+
+    if (version, table) not in KEY_INDEX:
+        # Older versions of the same table are no longer needed
+        for k in [k for k in KEY_INDEX if k[0][0] == version[0] \
+                                        and k[1] == table]:
+            del KEY_INDEX[k]
+        r = c.execute('SELECT {} FROM {}'.format(', '.join(keys), table))
+        full_df = pd.DataFrame(r.fetchall(), columns=keys)
+        KEY_INDEX[(version, table)] = np.unique(hash_keys(full_df, keys))
+
+    return KEY_INDEX[(version, table)]
+
+
+def invalidate_cache(db_file, keep=None):
+    """
+    Drops the cached key indexes and graphs of a database file. Stages that
+    rewrite the network or nodes tables call it right after the update.
+
+    :param db_file: (str) filename of the database
+    :param keep: (tuple) database version whose entries are kept, if any
+    """
+
+    path = os.path.abspath(db_file)
+
+    for cache in [KEY_INDEX, GRAPH_CACHE]:
+        for k in [k for k in cache if k[0][0] == path and k[0] != keep]:
+            del cache[k]
+
+
 #  ________________________________________
 # |                                        |
 # |        5: Query Validation Helper      |
@@ -95,28 +184,21 @@ def is_unique(df, edge=True):
     Check that all records in executed edge or node query are unique.
 
     :param df: (pd.DataFrame) contains node or edge data
-    :param edge: (bool) If True, count unique rows for edges query. If False,
-                 count unique rows for nodes query
+    :param edge: (bool) If True, check unique keys for edges query. If False,
+                 check unique keys for nodes query
 
     :return: (bool) True if rows are unique. False if otherwise
     """
 
-    num_records = len(df)
-
-    if edge:
-        grouped_df = df.groupby(by=['id_hdv', 'source', 'target', 'year'])
-        grouped_df = grouped_df.size().to_frame().reset_index()
-    else:
-        grouped_df = df.groupby(by=['node'])
-        grouped_df = grouped_df.size().to_frame().reset_index()
+    keys = EDGE_KEYS if edge else NODE_KEYS
 
-    return len(grouped_df) == num_records
+    return not df.duplicated(subset=keys).any()
 
 
 def has_erroneous_values(df, c, edge=True):
     """
     Check whether the executed query has erroneous values in the priority
-    columns.
+    columns, by looking up its keys in the cached key index of the database.
 
     :param df: (pd.DataFrame)
     :param c: (cursor object)
@@ -126,23 +208,10 @@ def has_erroneous_values(df, c, edge=True):
     :return: (bool) True if there are erroneous values. False if otherwise
     """
 
-    num_records = len(df)
-
-    if edge:
-        query = ''' SELECT * FROM network '''
-        r = c.execute(query)
-        header = get_header(c)
-        full_df = pd.DataFrame(r.fetchall(), columns=header)
-        merged_df = pd.merge(df, full_df, how='inner',
-                             on=['id_hdv', 'source', 'target', 'year'])
-    else:
-        query = ''' SELECT * FROM nodes '''
-        r = c.execute(query)
-        header = get_header(c)
-        full_df = pd.DataFrame(r.fetchall(), columns=header)
-        merged_df = pd.merge(df, full_df, how='inner', on='node')
+    keys = EDGE_KEYS if edge else NODE_KEYS
+    index = key_index(c, edge)
 
-    return len(merged_df) != num_records
+    return not np.isin(hash_keys(df, keys), index).all()
 
 
 #  ________________________________________
@@ -151,13 +220,14 @@ def has_erroneous_values(df, c, edge=True):
 # |________________________________________|
 
 
-def validate_edge_query(header, records, c):
+def validate_edge_query(header, records, c, trusted=False):
     """
     Check that the edge query is producing valid results.
 
     :param header: (list of strings) column headers to create DataFrame
     :param records: (list of tuples) values to use to fill DataFrame
     :param c: (cursor object)
+    :param trusted: (bool) If True, only the header is validated
 
     :return: (pd.DataFrame) Edge data with unique rows, no erroneous values, and
              necessary columns. Allows for additional attribute columns.
@@ -171,6 +241,8 @@ def validate_edge_query(header, records, c):
         print("Query error: Query must include 'id_hdv', 'origin', 'destiny',"
               "and 'year' attributes")
         return None
+    if trusted:
+        return df
     # Validate unique rows in executed query
     if not is_unique(df):
         print("Query error: Query contains duplicate rows")
@@ -183,13 +255,14 @@ def validate_edge_query(header, records, c):
     return df
 
 
-def validate_node_query(header, records, c):
+def validate_node_query(header, records, c, trusted=False):
     """
     Check that the node query is valid.
 
     :param header: (list of strings) column headers to create DataFrame
     :param records: (list of tuples) values to use to fill DataFrame
     :param c: (cursor object)
+    :param trusted: (bool) If True, only the header is validated
 
     :return: (pd.DataFrame) Node data with unique rows, no erroneous values, and
              necessary columns. Allows for additional attribute columns.
@@ -202,6 +275,8 @@ def validate_node_query(header, records, c):
     else:
         print("Query error: Query must include 'node' columns")
         return None
+    if trusted:
+        return df
     # Validate unique rows in executed query
     if not is_unique(df, edge=False):
         print("Query error: Query contains duplicate rows")
@@ -218,18 +293,66 @@ def validate_node_query(header, records, c):
 # |             7: Graph Builder           |
 # |________________________________________|
 
+def aggregate_edges(edge_df, directed=True):
+    """
+    Aggregates the candidate-level edge records into one weighted edge per
+    pair of parties, in a single grouped pass.
+
+    :param edge_df: (pd.DataFrame) edges records with 'id_hdv', 'source',
+                    'target' and 'year'
+    :param directed: (bool) If False, moves in both directions between two
+                     parties are aggregated together (both orientations are
+                     kept so the table reads the same from either end)
+
+    :return: (pd.DataFrame) one row per pair with 'source', 'target',
+             'weight' (number of moves), 'candidates' (distinct candidates),
+             'year_from' and 'year_to' (first and last year of the moves)
+    """
+
+    moves = edge_df[['id_hdv', 'source', 'target', 'year']]
+
+    if not directed:
+        flip = moves.loc[moves['source'] != moves['target']]
+        flip = flip.rename(columns={'source': 'target', 'target': 'source'})
+        moves = pd.concat([moves, flip], ignore_index=True, sort=False)
+
+    # Pairs in order of first appearance: nodes enter the graph in the same
+    # order as the records, which the community detection tie-breaks rely on
+    grouped = moves.groupby(['source', 'target'], sort=False)
+    weighted = pd.DataFrame({'weight': grouped.size(),
+                             'candidates': grouped['id_hdv'].nunique(),
+                             'year_from': grouped['year'].min(),
+                             'year_to': grouped['year'].max()})
+
+    return weighted.reset_index()
+
+
 def build_graph(edge_df, node_df, graph_type=nx.Graph):
     """
-    Build a graph from edge dataframe and node dataframe
+    Build a graph from edge dataframe and node dataframe. Candidate-level
+    edges are first aggregated into one weighted edge per pair of parties, so
+    parallel moves are counted instead of overwriting each other.
 
     :param edge_df: (pd.DataFrame) edges records
     :param node_df: (pd.DataFrame) nodes records
-    :param graph_type: (networkx graph class) graph class to use to build graph
+    :param graph_type: (networkx graph class or sg.SparseGraph) graph class to
+                       use to build graph. sg.SparseGraph builds the CSR
+                       backend straight from the dataframes
 
-    :return: networkx graph object
+    :return: networkx graph object (or sg.SparseGraph)
     """
 
     node_df.set_index('node', inplace=True) # sets index using 'node' column
+    candidate_level = is_header_valid(list(edge_df.columns))
+
+    if graph_type is sg.SparseGraph:
+        if candidate_level:
+            edge_df = aggregate_edges(edge_df)
+        return sg.SparseGraph(edge_df, node_df, directed=True)
+
+    if candidate_level:
+        edge_df = aggregate_edges(edge_df, graph_type().is_directed())
+
     G = nx.from_pandas_edgelist(edge_df, edge_attr=True,
                                 create_using=graph_type)
 
@@ -268,11 +391,19 @@ def network_structure(db_file, edge_query, node_query, \
     The set of unique nodes in the edges table should be the same as the set of
     nodes in the nodes table.
 
+    Queries listed in queries.trusted are valid by construction, so only their
+    header is validated.
+
+    Results are cached by database version, queries and graph class.
+    Repeated calls hand back copies of the cached graph and dataframes, so
+    callers can change them without altering the cache.
+
 
     :param db_file: (str) filename for database to query
     :param edge_query: (str) SQL query to execute for edges
     :param node_query: (str) SQL query to execute for nodes
-    :param graph: (networkx graph class) graph class to use to build graph
+    :param graph: (networkx graph class or sg.SparseGraph) graph class to use
+                  to build graph
     :param edge_only: (bool) validate only the edge query and return only the
                       the edge pd.DataFrame. Defaults to False.
 
@@ -280,6 +411,28 @@ def network_structure(db_file, edge_query, node_query, \
              the edge and node pd.DataFrame
     """
 
+    version = db_version(db_file)
+    key = (version, edge_query, node_query, graph, edge_only)
+    if key not in GRAPH_CACHE:
+        rv = build_structure(db_file, edge_query, node_query, graph, edge_only)
+        if rv is None:
+            return None
+        invalidate_cache(db_file, keep=version)
+        GRAPH_CACHE[key] = rv
+
+    if edge_only:
+        return GRAPH_CACHE[key].copy()
+    G, edge_df, node_df = GRAPH_CACHE[key]
+
+    return G.copy(), edge_df.copy(), node_df.copy()
+
+
+def build_structure(db_file, edge_query, node_query, graph, edge_only):
+    """
+    Executes and validates the edge and node queries and builds the graph.
+    See network_structure for the arguments and the required query formats.
+    """
+
     conn = sqlite3.connect(db_file)
     c = conn.cursor()
 
@@ -300,13 +453,15 @@ def network_structure(db_file, edge_query, node_query, \
         node_header = get_header(c)
         node_records = node_r.fetchall()
 
-    edge_df = validate_edge_query(edge_header, edge_records, c)
+    edge_df = validate_edge_query(edge_header, edge_records, c,
+                                  trusted=edge_query in q.trusted)
     if edge_df is None:
         print("Query error: Edge query is invalid")
         return None
 
     if not edge_only:
-        node_df = validate_node_query(node_header, node_records, c)
+        node_df = validate_node_query(node_header, node_records, c,
+                                      trusted=node_query in q.trusted)
         if node_df is None:
             print("Query error: Node query is invalid")
             return None
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Structural Summary of the Network        |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Computes the structural summary of the full network (size, density,
+reciprocity, transitivity and clustering, k-cores, assortativity and the
+degree distribution) with a few vectorized passes over the sparse adjacency.
+Summaries are cached by database version, so the network metrics menu reads
+them instantly after the first time.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import os, sys
+import numpy as np
+import pandas as pd
+
+#  ________________________________________
+# |                                        |
+# |            2: Local Modules            |
+# |________________________________________|
+
+import party_switching as ps
+import network_structure as ns
+import sparse_graph as sg
+import queries as q
+import db_config as db
+
+#  ________________________________________
+# |                                        |
+# |               3: Settings              |
+# |________________________________________|
+
+os.chdir(ps.wd)
+sys.path.append(os.chdir(ps.wd))
+
+#Globals
+SUMMARY_CACHE = {} #Summaries by database version and queries
+
+#  ________________________________________
+# |                                        |
+# |           4: Helper Functions          |
+# |________________________________________|
+
+def simple_adjacency(G):
+    '''
+    Binary adjacency without self loops, and its undirected (symmetric)
+    version
+    '''
+    B = G.bin.tolil()
+    B.setdiag(0)
+    B = B.tocsr()
+    B.eliminate_zeros()
+    S = ((B + B.T) > 0).astype(float).tocsr()
+
+    return B, S
+
+
+def triangles(A):
+    '''
+    Number of closed paths v -> w -> u with v -> u, for every node v
+    '''
+    return np.asarray((A @ A).multiply(A).sum(axis=1)).ravel()
+
+
+def core_number(S):
+    '''
+    k-core number of every node of a symmetric adjacency. Peels all the
+    nodes below the current k at once, updating the degrees with a sparse
+    product per round.
+    '''
+    n = S.shape[0]
+    deg = np.asarray(S.sum(axis=1)).ravel()
+    alive = np.ones(n, dtype=bool)
+    core = np.zeros(n, dtype=int)
+    k = 0
+    while alive.any():
+        peel = alive & (deg <= k)
+        if not peel.any():
+            k = deg[alive].min()
+            continue
+        core[peel] = k
+        alive[peel] = False
+        deg -= S @ peel.astype(float)
+
+    return core
+
+
+def assortativity(x, y):
+    '''
+    Pearson correlation of the degrees at both ends of the edges
+    '''
+    if len(x) < 2 or x.std() == 0 or y.std() == 0:
+        return np.nan
+    return np.corrcoef(x, y)[0, 1]
+
+#  ________________________________________
+# |                                        |
+# |           5: Summary Engine            |
+# |________________________________________|
+
+def structural_summary(G):
+    '''
+    Computes the structural summary of a directed SparseGraph.
+
+    Input:
+        G: (sg.SparseGraph) the network
+    Output:
+        summary: (pd.DataFrame) one row per metric, with its value
+        degree_dist: (pd.DataFrame) number of nodes by degree
+        core: (pd.Series) k-core number of every node
+    '''
+    n = G.number_of_nodes()
+    m = G.number_of_edges()
+    B, S = simple_adjacency(G)
+
+    in_deg = G.degree_array('in')
+    out_deg = G.degree_array('out')
+
+    # Reciprocity: edges whose reverse edge is also in the network
+    reciprocity = B.multiply(B.T).nnz / m if m else 0
+
+    # Transitivity over successors, as nx.transitivity on a DiGraph
+    d = np.asarray(B.sum(axis=1)).ravel()
+    pairs = (d * (d - 1)).sum()
+    transitivity = triangles(B).sum() / pairs if pairs else 0
+
+    # Clustering of the undirected network
+    du = np.asarray(S.sum(axis=1)).ravel()
+    cu = np.divide(triangles(S), du * (du - 1), out=np.zeros(n),
+                   where=du > 1)
+
+    core = core_number(S)
+
+    # Degree assortativity: out degree of the source, in degree of the target
+    src = np.repeat(np.arange(n), np.diff(G.indptr))
+    assort = assortativity(out_deg[src].astype(float),
+                           in_deg[G.indices].astype(float))
+
+    summary = pd.DataFrame([
+        ('Number of nodes', n),
+        ('Number of edges', m),
+        ('Number of moves', G.weight.sum()),
+        ('Average in degree', in_deg.mean()),
+        ('Average out degree', out_deg.mean()),
+        ('Density', G.density()),
+        ('Reciprocity', reciprocity),
+        ('Transitivity', transitivity),
+        ('Average clustering (undirected)', cu.mean()),
+        ('Max k-core', core.max() if n else 0),
+        ('Degree assortativity (out-in)', assort)],
+        columns=['metric', 'value']).set_index('metric')
+
+    degree = in_deg + out_deg
+    degree_dist = pd.DataFrame({'degree': np.arange(degree.max() + 1),
+                                'nodes': np.bincount(degree)})
+    degree_dist = degree_dist.loc[degree_dist['nodes'] > 0]
+
+    return summary, degree_dist, pd.Series(core, index=G.node_index)
+
+
+def network_summary(db_file=db.db_file, edge_query=q.all_network,
+                    node_query=q.all_nodes):
+    '''
+    Structural summary of the network in the database, computed once per
+    database version (see structural_summary for the output).
+    '''
+    key = (ns.db_version(db_file), edge_query, node_query)
+    if key not in SUMMARY_CACHE:
+        G = ns.network_structure(db_file, edge_query, node_query,
+                                 graph=sg.SparseGraph)[0]
+        for k in [k for k in SUMMARY_CACHE if k[0][0] == key[0][0]]:
+            del SUMMARY_CACHE[k]
+        SUMMARY_CACHE[key] = structural_summary(G)
+
+    return SUMMARY_CACHE[key]
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Null Model Permutation Tests             |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Significance tests for the modularity of the clusters and for the top
+centralities of the network. Each replicate is a degree-preserving
+randomization of the party switches (directed configuration model: the
+targets of the switches are shuffled, so every party keeps its number of
+moves in and out), built directly as a sparse adjacency. The candidates that
+stay in their party (self loops) are kept as they are, and the shuffle does
+not create new ones. Every replicate is clustered again with the same
+method as the network, so the modularity is compared with the best found in
+the random networks. Replicates run in a process pool with one seed per
+replicate, so the results do not depend on the number of workers, and the
+empirical p-values are reported.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import os, sys
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+#  ________________________________________
+# |                                        |
+# |            2: Local Modules            |
+# |________________________________________|
+
+import party_switching as ps
+import network_structure as ns
+import community_detection as cd
+import sparse_graph as sg
+import spectral as spc
+import queries as q
+import db_config as db
+
+#  ________________________________________
+# |                                        |
+# |               3: Settings              |
+# |________________________________________|
+
+os.chdir(ps.wd)
+sys.path.append(os.chdir(ps.wd))
+
+#Globals
+CLUSTER_METHOD = 'cnm' #As the clusters of gen_clusters (see cd.METHODS)
+MAX_SWAPS = 1000 #Tries to move a switch that became a self loop
+WORKER_DATA = None #Moves, method and tested nodes shared by the workers
+
+#  ________________________________________
+# |                                        |
+# |           4: Helper Functions          |
+# |________________________________________|
+
+def moves(G):
+    '''
+    Source and target position of every switch of a SparseGraph (an edge
+    with weight w appears w times), and the number of stays (self loops) of
+    every node
+    '''
+    counts = G.adj.data.astype(int)
+    src = np.repeat(np.repeat(np.arange(G.number_of_nodes()),
+                              np.diff(G.adj.indptr)), counts)
+    tgt = np.repeat(G.adj.indices, counts)
+    loop = src == tgt
+    stays = np.bincount(src[loop], minlength=G.number_of_nodes())
+
+    return src[~loop], tgt[~loop], stays
+
+
+def null_adjacency(src, tgt, stays, n, rng):
+    '''
+    Weighted adjacency of a configuration model replicate: the targets of the
+    switches are permuted, keeping the in and out strength of every node.
+    Switches that become self loops swap their target with another switch,
+    and the stays are added back unchanged.
+    '''
+    tgt = rng.permutation(tgt)
+    for i in np.flatnonzero(src == tgt):
+        for _ in range(MAX_SWAPS):
+            j = rng.integers(len(tgt))
+            if src[j] != tgt[i] and src[i] != tgt[j]:
+                tgt[i], tgt[j] = tgt[j], tgt[i]
+                break
+
+    A = sp.csr_matrix((np.ones(len(src)), (src, tgt)), shape=(n, n))
+    A = A + sp.diags(stays.astype(float), format='csr')
+    A.sum_duplicates()
+    A.eliminate_zeros()
+
+    return A
+
+
+def symmetric(A):
+    '''
+    Binary undirected adjacency without self loops, as used by the greedy
+    modularity clusters
+    '''
+    S = A.tolil()
+    S.setdiag(0)
+    S = S.tocsr()
+    S.eliminate_zeros()
+
+    return ((S + S.T) > 0).astype(float).tocsr()
+
+
+def cluster_modularity(S, method, nodes, rng):
+    '''
+    Modularity of the partition found by a community detection method
+    '''
+    if method == 'cnm':
+        labels = cd.greedy_modularity(S, nodes=nodes)
+    else:
+        labels = cd.METHODS[method](S, seed=int(rng.integers(2**31)))
+
+    return sg.modularity(S, labels)
+
+
+def statistics(A, method, nodes, bc_nodes, pr_nodes, pivots=None, rng=None):
+    '''
+    Modularity of the clusters and the betweenness and PageRank of the
+    tested nodes, for a weighted adjacency.
+
+    Inputs:
+        A: (sp.csr_matrix) adjacency weighted by moves
+        method: (str) community detection method (see cd.METHODS), None to
+                skip modularity
+        nodes: (pd.Index) node of every row, for the CNM tie-breaks
+        bc_nodes, pr_nodes: (np.array) positions of the tested nodes
+        pivots: (int) number of sampled betweenness sources. None for exact
+        rng: (np.random.Generator) generator for the pivot sampling and the
+             randomized methods
+    Returns:
+        (tuple) modularity, betweenness and PageRank of the tested nodes
+    '''
+    n = A.shape[0]
+    Q = np.nan if method is None else \
+        cluster_modularity(symmetric(A), method, nodes, rng)
+
+    B = A.copy()
+    B.data[:] = 1
+    if pivots is None or pivots >= n:
+        bc = sg.source_dependencies(B, np.arange(n))
+    else:
+        sources = np.sort(rng.choice(n, pivots, replace=False))
+        bc = sg.source_dependencies(B, sources) * n / pivots
+    if n > 2:
+        bc = bc / ((n - 1) * (n - 2))
+
+    pr = spc.pagerank_matrix(A, np.ones((n, 1)))[0].ravel()
+
+    return Q, bc[bc_nodes], pr[pr_nodes]
+
+#  ________________________________________
+# |                                        |
+# |              5: Workers                |
+# |________________________________________|
+
+def init_worker(data):
+    '''
+    Receives the moves, method and tested nodes once per worker
+    '''
+    global WORKER_DATA
+    WORKER_DATA = data
+
+
+def replicate(seed):
+    '''
+    Statistics of one null replicate, generated from its own seed
+    '''
+    n, src, tgt, stays, method, nodes, bc_nodes, pr_nodes, pivots = \
+        WORKER_DATA
+    rng = np.random.default_rng(seed)
+    A = null_adjacency(src, tgt, stays, n, rng)
+
+    return statistics(A, method, nodes, bc_nodes, pr_nodes, pivots, rng)
+
+#  ________________________________________
+# |                                        |
+# |          6: Permutation Tests          |
+# |________________________________________|
+
+def p_value(observed, null):
+    '''
+    Empirical one-sided p-value of the observed statistic against the null
+    replicates (rows)
+    '''
+    return (1 + (null >= observed).sum(axis=0)) / (len(null) + 1)
+
+
+def permutation_test(G=None, replicates=200, top=10, processes=None,
+                     seed=1234, pivots=None, method=CLUSTER_METHOD):
+    '''
+    Tests the modularity of the clusters and the betweenness and PageRank of
+    the top nodes against degree-preserving null replicates. The network and
+    every replicate are clustered with the same method.
+
+    Inputs:
+        G: (sg.SparseGraph) the network. Defaults to the full network
+        replicates: (int) number of null replicates
+        top: (int) number of top nodes tested for each centrality
+        processes: (int) number of workers. Defaults to the number of CPUs,
+                   1 runs in this process
+        seed: (int) seed of the replicates
+        pivots: (int) sampled betweenness sources per replicate. None for
+                exact betweenness
+        method: (str) community detection method (see cd.METHODS), None to
+                skip the modularity test
+    Returns:
+        results: (pd.DataFrame) one row per tested statistic with the
+                 observed value, mean and standard deviation under the null
+                 and empirical p-value
+    '''
+    if G is None:
+        G = ns.network_structure(db.db_file, q.all_network, q.all_nodes,
+                                 graph=sg.SparseGraph)[0]
+    n = G.number_of_nodes()
+    src, tgt, stays = moves(G)
+
+    # Observed statistics, computed exactly as in the replicates
+    rng = np.random.default_rng(seed)
+    Q, bc, pr = statistics(G.adj, method, G.node_index, np.arange(n),
+                           np.arange(n), pivots, rng)
+    bc_nodes = np.argsort(-bc, kind='stable')[:top]
+    pr_nodes = np.argsort(-pr, kind='stable')[:top]
+
+    data = (n, src, tgt, stays, method, G.node_index, bc_nodes, pr_nodes,
+            pivots)
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+    if processes is None:
+        processes = mp.cpu_count()
+
+    if processes <= 1:
+        init_worker(data)
+        null = [replicate(s) for s in seeds]
+    else:
+        with mp.Pool(processes, initializer=init_worker,
+                     initargs=(data,)) as pool:
+            null = pool.map(replicate, seeds)
+
+    null_Q = np.array([r[0] for r in null])
+    null_bc = np.array([r[1] for r in null])
+    null_pr = np.array([r[2] for r in null])
+
+    rows = []
+    if method is not None:
+        rows.append(('modularity', None, Q, null_Q))
+    for stat, nodes, observed, sample in [('betweeness', bc_nodes, bc,
+                                           null_bc),
+                                          ('pagerank', pr_nodes, pr,
+                                           null_pr)]:
+        for j, i in enumerate(nodes):
+            rows.append((stat, G.node_index[i], observed[i], sample[:, j]))
+
+    results = pd.DataFrame({
+        'statistic': [r[0] for r in rows],
+        'node': pd.Series([r[1] for r in rows], dtype=object),
+        'observed': [r[2] for r in rows],
+        'null_mean': [r[3].mean() for r in rows],
+        'null_std': [r[3].std() for r in rows],
+        'p_value': [p_value(r[2], r[3]) for r in rows]})
+
+    if 'p_name' in G.node_attrs.columns:
+        names = G.node_attrs['p_name']
+        results.insert(2, 'party_name', results['node'].map(names))
+
+    return results
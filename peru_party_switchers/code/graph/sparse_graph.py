@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Sparse Graph Backend                     |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Alternative backend for network_structure.build_graph. The party switching
+network is stored as a CSR adjacency matrix (edge multiplicity as data, with
+the first and last year of the moves aligned to it) and a columnar node
+attribute table, instead of the dict-of-dicts of networkx. It offers adapters
+for the networkx calls used in the project, and the degree, neighbor degree
+and centrality computations run directly on the sparse matrix.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import copy
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+#  ________________________________________
+# |                                        |
+# |           2: Helper Functions          |
+# |________________________________________|
+
+def group_pairs(edge_df, directed=True):
+    """
+    Groups the edge records by node pair.
+
+    :param edge_df: (pd.DataFrame) edge records with 'source' and 'target'
+                    columns and, optionally, 'weight' and 'year'
+    :param directed: (bool) If False, (u, v) and (v, u) are the same pair
+
+    :return: (pd.DataFrame) one row per pair with 'source', 'target',
+             'weight', 'year_from' and 'year_to'
+    """
+
+    pairs = pd.DataFrame({'source': edge_df['source'].values,
+                          'target': edge_df['target'].values})
+    if 'weight' in edge_df.columns:
+        pairs['weight'] = edge_df['weight'].values
+    else:
+        pairs['weight'] = 1
+    if 'year' in edge_df.columns:
+        pairs['year_from'] = edge_df['year'].values
+        pairs['year_to'] = edge_df['year'].values
+    elif 'year_from' in edge_df.columns:
+        pairs['year_from'] = edge_df['year_from'].values
+        pairs['year_to'] = edge_df['year_to'].values
+    else:
+        pairs['year_from'] = np.nan
+        pairs['year_to'] = np.nan
+
+    if not directed:
+        flip = pairs.loc[pairs['source'] != pairs['target']]
+        flip = flip.rename(columns={'source': 'target', 'target': 'source'})
+        pairs = pd.concat([pairs, flip], ignore_index=True, sort=False)
+
+    pairs = pairs.groupby(['source', 'target']).agg({'weight': 'sum',
+                                                     'year_from': 'min',
+                                                     'year_to': 'max'})
+
+    return pairs.reset_index()
+
+
+def source_dependencies(A, sources):
+    """
+    Accumulates the Brandes dependencies of the given sources, running the
+    breadth first searches level by level as sparse matrix products.
+
+    :param A: (sp.csr_matrix) binary adjacency matrix
+    :param sources: (iterable of int) positions of the source nodes
+
+    :return: (np.array) unnormalized betweenness contributed by the sources
+    """
+
+    n = A.shape[0]
+    A = A.tocsr()
+    AT = A.T.tocsr()
+    bc = np.zeros(n)
+
+    for s in sources:
+        sigma = np.zeros(n)
+        sigma[s] = 1
+        seen = np.zeros(n, dtype=bool)
+        seen[s] = True
+        levels = [np.array([s])]
+
+        # Forward: shortest path counts, one level at a time
+        push = np.zeros(n)
+        while True:
+            frontier = levels[-1]
+            push[frontier] = sigma[frontier]
+            paths = AT @ push
+            push[frontier] = 0
+            new = np.flatnonzero((paths > 0) & ~seen)
+            if len(new) == 0:
+                break
+            sigma[new] = paths[new]
+            seen[new] = True
+            levels.append(new)
+
+        # Backward: dependencies from the deepest level to the source
+        delta = np.zeros(n)
+        coef = np.zeros(n)
+        for lvl in range(len(levels) - 1, 0, -1):
+            W, V = levels[lvl], levels[lvl - 1]
+            coef[W] = (1 + delta[W]) / sigma[W]
+            delta[V] += sigma[V] * (A @ coef)[V]
+            coef[W] = 0
+
+        delta[s] = 0
+        bc += delta
+
+    return bc
+
+
+def modularity(S, labels, resolution=1):
+    """
+    Newman modularity of a partition of an undirected graph.
+
+    :param S: (sp.csr_matrix) symmetric adjacency without self loops
+    :param labels: (array) community of every node, in adjacency order
+    :param resolution: (float) weight of the null model term. Values above 1
+                       favour smaller communities
+
+    :return: (float) modularity
+    """
+
+    n = S.shape[0]
+    codes = pd.factorize(np.asarray(labels))[0]
+    C = sp.csr_matrix((np.ones(n), (np.arange(n), codes)))
+    k = np.asarray(S.sum(axis=1)).ravel()
+    two_m = k.sum()
+    if two_m == 0:
+        return 0
+
+    within = (C.T @ S @ C).diagonal().sum()
+    deg_c = C.T @ k
+
+    return within / two_m - resolution * ((deg_c / two_m) ** 2).sum()
+
+
+#  ________________________________________
+# |                                        |
+# |              3: Views                  |
+# |________________________________________|
+
+class NodeView:
+    '''
+    networkx-like view of the nodes: iterable, callable and subscriptable
+    with the node attributes as a dictionary.
+    '''
+
+    def __init__(self, G):
+        self.G = G
+
+    def __iter__(self):
+        return iter(self.G.node_index)
+
+    def __len__(self):
+        return len(self.G.node_index)
+
+    def __contains__(self, node):
+        return node in self.G.node_index
+
+    def __getitem__(self, node):
+        return self.G.node_attrs.loc[node].to_dict()
+
+    def __call__(self, data=False):
+        if data:
+            return list(zip(self.G.node_index,
+                            self.G.node_attrs.to_dict('records')))
+        return list(self.G.node_index)
+
+
+class DegreeView:
+    '''
+    networkx-like degree view: iterable of (node, degree) pairs, subscriptable
+    by node and callable with a node bunch and weight.
+    '''
+
+    def __init__(self, G, direction):
+        self.G = G
+        self.direction = direction
+
+    def __call__(self, nbunch=None, weight=None):
+        deg = pd.Series(self.G.degree_array(self.direction, weight),
+                        index=self.G.node_index)
+        if nbunch is None:
+            return dict(deg)
+        if np.isscalar(nbunch):
+            return deg[nbunch]
+        return dict(deg[list(nbunch)])
+
+    def __iter__(self):
+        return iter(self().items())
+
+    def __getitem__(self, node):
+        return self(node)
+
+    def __len__(self):
+        return len(self.G.node_index)
+
+
+#  ________________________________________
+# |                                        |
+# |             4: Sparse Graph            |
+# |________________________________________|
+
+class SparseGraph:
+    '''
+    Graph stored as a CSR adjacency matrix and a node attribute table. The
+    data of the matrix is the number of moves between each pair of parties,
+    and year_from/year_to hold the first and last year of those moves in the
+    same order as the CSR entries.
+    '''
+
+    def __init__(self, edge_df, node_df, directed=True):
+        '''
+        Builds the CSR adjacency and the node attribute table.
+
+        Input:
+            edge_df: (pd.DataFrame) edge records with 'source' and 'target',
+                optionally 'weight' and 'year' (or 'year_from'/'year_to')
+            node_df: (pd.DataFrame) node attributes indexed by node
+            directed: (bool) whether the graph is directed
+        '''
+        self.directed = directed
+        self.name = ''
+
+        edge_nodes = pd.Index(edge_df['source']).append(
+                     pd.Index(edge_df['target'])).unique()
+        missing = edge_nodes.difference(node_df.index)
+        self.node_attrs = node_df.reindex(node_df.index.append(missing))
+        self.node_index = self.node_attrs.index
+
+        pairs = group_pairs(edge_df, directed)
+        src = self.node_index.get_indexer(pairs['source'])
+        tgt = self.node_index.get_indexer(pairs['target'])
+        order = np.lexsort((tgt, src))
+        src, tgt = src[order], tgt[order]
+
+        n = len(self.node_index)
+        self.indptr = np.concatenate([[0],
+                                      np.cumsum(np.bincount(src, minlength=n))])
+        self.indices = tgt
+        self.weight = pairs['weight'].values[order].astype(float)
+        self.year_from = pairs['year_from'].values[order]
+        self.year_to = pairs['year_to'].values[order]
+        self.adj = sp.csr_matrix((self.weight, self.indices, self.indptr),
+                                 shape=(n, n))
+        self.bin = sp.csr_matrix((np.ones(len(self.indices)), self.indices,
+                                  self.indptr), shape=(n, n))
+
+    #   ______________________
+    #  |  networkx adapters   |
+    #  |______________________|
+
+    @property
+    def nodes(self):
+        return NodeView(self)
+
+    @property
+    def degree(self):
+        return DegreeView(self, 'all')
+
+    @property
+    def in_degree(self):
+        return DegreeView(self, 'in')
+
+    @property
+    def out_degree(self):
+        return DegreeView(self, 'out')
+
+    def __len__(self):
+        return len(self.node_index)
+
+    def __iter__(self):
+        return iter(self.node_index)
+
+    def __contains__(self, node):
+        return node in self.node_index
+
+    def is_directed(self):
+        return self.directed
+
+    def copy(self):
+        '''
+        Copy with its own node attributes. The CSR arrays are shared, they
+        are never modified in place.
+        '''
+        H = copy.copy(self)
+        H.node_attrs = self.node_attrs.copy()
+        H.node_index = H.node_attrs.index
+
+        return H
+
+    def number_of_nodes(self):
+        return len(self.node_index)
+
+    def number_of_edges(self):
+        if self.directed:
+            return len(self.indices)
+        loops = np.count_nonzero(self.bin.diagonal())
+        return (len(self.indices) + loops) // 2
+
+    def edge_table(self):
+        '''
+        Returns the edges as a dataframe with one row per CSR entry
+        '''
+        src = np.repeat(np.arange(len(self.node_index)), np.diff(self.indptr))
+        return pd.DataFrame({'source': self.node_index[src],
+                             'target': self.node_index[self.indices],
+                             'weight': self.weight,
+                             'year_from': self.year_from,
+                             'year_to': self.year_to})
+
+    def edges(self, data=False):
+        '''
+        Returns the edges as a list of (u, v) or (u, v, attributes) tuples
+        '''
+        df = self.edge_table()
+        if not self.directed:
+            df = df.loc[self.node_index.get_indexer(df['source']) <= \
+                        self.node_index.get_indexer(df['target'])]
+        if not data:
+            return list(df[['source', 'target']].itertuples(index=False,
+                                                            name=None))
+        attrs = df[['weight', 'year_from', 'year_to']].to_dict('records')
+        return [(u, v, d) for u, v, d in zip(df['source'], df['target'],
+                                             attrs)]
+
+    def subgraph(self, nodes):
+        '''
+        Returns the subgraph induced by nodes as a new SparseGraph
+        '''
+        nodes = [n for n in nodes if n in self.node_index]
+        df = self.edge_table()
+        df = df.loc[df['source'].isin(nodes) & df['target'].isin(nodes)]
+        if not self.directed: # each pair once, it is mirrored again
+            df = df.loc[self.node_index.get_indexer(df['source']) <= \
+                        self.node_index.get_indexer(df['target'])]
+
+        return SparseGraph(df, self.node_attrs.loc[nodes], self.directed)
+
+    def to_undirected(self):
+        '''
+        Returns the undirected version of the graph. The weight of a pair is
+        the number of moves in both directions.
+        '''
+        return SparseGraph(self.edge_table(), self.node_attrs, directed=False)
+
+    def to_networkx(self, graph_type=None):
+        '''
+        Converts the graph into a networkx graph, for drawing or algorithms
+        not covered by this backend.
+        '''
+        if graph_type is None:
+            graph_type = nx.DiGraph if self.directed else nx.Graph
+        G = nx.from_pandas_edgelist(self.edge_table(), edge_attr=True,
+                                    create_using=graph_type)
+        G.add_nodes_from(self.node_index)
+        for col in self.node_attrs.columns:
+            nx.set_node_attributes(G, self.node_attrs[col], col)
+
+        return G
+
+    #   ______________________
+    #  |     Computations     |
+    #  |______________________|
+
+    def degree_array(self, direction='all', weight=None):
+        '''
+        Degree of every node, in node_index order. As in networkx, a self
+        loop adds 2 to the degree of its node.
+
+        Input:
+            direction: (str) 'in', 'out' or 'all'
+            weight: (str) If 'weight', counts the moves instead of neighbors
+        '''
+        A = self.adj if weight else self.bin.astype(int)
+        out_deg = np.asarray(A.sum(axis=1)).ravel()
+        in_deg = np.asarray(A.sum(axis=0)).ravel()
+        if not self.directed:
+            return out_deg + A.diagonal()
+        if direction == 'out':
+            return out_deg
+        if direction == 'in':
+            return in_deg
+        return out_deg + in_deg
+
+    def density(self):
+        '''
+        Density of the graph, as nx.density
+        '''
+        n = self.number_of_nodes()
+        if n <= 1:
+            return 0
+        d = self.number_of_edges() / (n * (n - 1))
+        return d if self.directed else d * 2
+
+    def average_neighbor_degree(self):
+        '''
+        Average degree of the neighbors of every node, as the default of
+        nx.average_neighbor_degree (successors and out degree if directed).
+        '''
+        deg = self.degree_array('out' if self.directed else 'all')
+        nbr_deg = self.bin @ deg
+        avg = np.divide(nbr_deg, deg, out=np.zeros(len(deg)), where=deg > 0)
+
+        return dict(zip(self.node_index, avg))
+
+    def betweenness_centrality(self, normalized=True):
+        '''
+        Shortest path betweenness centrality of every node, as
+        nx.betweenness_centrality with unweighted edges.
+        '''
+        n = self.number_of_nodes()
+        bc = source_dependencies(self.bin, range(n))
+
+        if normalized and n > 2:
+            bc *= 1 / ((n - 1) * (n - 2))
+        elif not normalized and not self.directed:
+            bc *= 0.5
+
+        return dict(zip(self.node_index, bc))
+
+    def eigenvector_centrality(self, max_iter=100, tol=1.0e-6):
+        '''
+        Eigenvector centrality of every node, with the shifted power iteration
+        of nx.eigenvector_centrality (in-edges if directed).
+        '''
+        n = self.number_of_nodes()
+        AT = self.bin.T.tocsr()
+        x = np.ones(n) / n
+        for _ in range(max_iter):
+            xlast = x
+            x = xlast + AT @ xlast
+            norm = np.linalg.norm(x) or 1
+            x = x / norm
+            if np.abs(x - xlast).sum() < n * tol:
+                return dict(zip(self.node_index, x))
+
+        raise nx.PowerIterationFailedConvergence(max_iter)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Spectral Centrality Engine               |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Eigenvector centrality, PageRank and personalized PageRank computed with
+sparse linear algebra on the adjacency of a SparseGraph. Every function
+returns its convergence diagnostics instead of failing, since the sink
+parties of the switching network can keep the power iteration from
+converging. Personalized PageRank is solved for all the parties at once as
+a single matrix iteration.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse import linalg as spla
+
+
+#  ________________________________________
+# |                                        |
+# |           2: Helper Functions          |
+# |________________________________________|
+
+def transition_matrix(A):
+    '''
+    Transposed row-stochastic transition matrix of a weighted adjacency
+    and the mask of the dangling (sink) nodes.
+    '''
+    out_w = np.asarray(A.sum(axis=1)).ravel()
+    dangling = out_w == 0
+    inv = np.divide(1, out_w, out=np.zeros(len(out_w)), where=~dangling)
+    PT = (sp.diags(inv) @ A).T.tocsr()
+
+    return PT, dangling
+
+
+def power_iteration(step, X, max_iter, tol):
+    '''
+    Iterates X = step(X) until the L1 change of every column is below
+    n * tol, as networkx does.
+
+    Returns:
+        X: (np.array) last iterate
+        info: (dict) iterations, residual (largest column change) and
+              converged flag
+    '''
+    n = X.shape[0]
+    residual = np.inf
+    for it in range(1, max_iter + 1):
+        Xlast = X
+        X = step(Xlast)
+        residual = np.abs(X - Xlast).sum(axis=0).max()
+        if residual < n * tol:
+            return X, {'iterations': it, 'residual': residual,
+                       'converged': True}
+
+    return X, {'iterations': max_iter, 'residual': residual,
+               'converged': False}
+
+#  ________________________________________
+# |                                        |
+# |        3: Eigenvector Centrality       |
+# |________________________________________|
+
+def eigenvector_centrality(G, max_iter=100, tol=1.0e-6):
+    '''
+    Eigenvector centrality of every node (in-edges if directed). Runs the
+    shifted power iteration of nx.eigenvector_centrality and, if it does not
+    converge, falls back to ARPACK for the leading eigenvector.
+
+    Inputs:
+        G: (sg.SparseGraph) the graph
+        max_iter: (int) maximum number of power iterations
+        tol: (float) tolerance of the power iteration
+    Returns:
+        centrality: (dict) eigenvector centrality by node
+        info: (dict) method, iterations, residual and converged flag
+    '''
+    n = G.number_of_nodes()
+    AT = G.bin.T.tocsr()
+
+    def step(x):
+        x = x + AT @ x
+        return x / (np.linalg.norm(x) or 1)
+
+    x, info = power_iteration(step, np.ones((n, 1)) / n, max_iter, tol)
+    info['method'] = 'power'
+
+    if not info['converged'] and n > 2:
+        try:
+            vals, vecs = spla.eigs(AT.astype(float), k=1, which='LR',
+                                   maxiter=max_iter * n, tol=tol)
+            x = np.abs(np.real(vecs))
+            x = x / (np.linalg.norm(x) or 1)
+            lam = np.real(vals[0])
+            residual = np.abs(AT @ x - lam * x).sum()
+            info = {'method': 'arpack', 'iterations': None,
+                    'residual': residual, 'converged': residual < n * tol}
+        except spla.ArpackNoConvergence:
+            info['method'] = 'power'
+
+    return dict(zip(G.node_index, x.ravel())), info
+
+#  ________________________________________
+# |                                        |
+# |               4: PageRank              |
+# |________________________________________|
+
+def pagerank_matrix(A, personalization, alpha=0.85, max_iter=100,
+                    tol=1.0e-6):
+    '''
+    Solves PageRank for every column of the personalization matrix in one
+    batched iteration. The mass of the dangling nodes is redistributed
+    following the personalization, as in nx.pagerank.
+
+    Inputs:
+        A: (sp.csr_matrix) weighted adjacency (G.adj weights by moves)
+        personalization: (np.array) n x m matrix, one distribution per column
+        alpha: (float) damping parameter
+        max_iter: (int) maximum number of iterations
+        tol: (float) tolerance, as in nx.pagerank
+    Returns:
+        X: (np.array) n x m matrix of PageRank vectors
+        info: (dict) iterations, residual and converged flag
+    '''
+    PT, dangling = transition_matrix(A)
+    V = personalization / personalization.sum(axis=0)
+
+    def step(X):
+        lost = X[dangling].sum(axis=0)
+        return alpha * (PT @ X + V * lost) + (1 - alpha) * V
+
+    return power_iteration(step, V.copy(), max_iter, tol)
+
+
+def pagerank(G, alpha=0.85, max_iter=100, tol=1.0e-6):
+    '''
+    Global PageRank of every node, weighting the edges by the number of
+    moves.
+
+    Returns:
+        pr: (dict) PageRank by node
+        info: (dict) convergence diagnostics (see pagerank_matrix)
+    '''
+    n = G.number_of_nodes()
+    X, info = pagerank_matrix(G.adj, np.ones((n, 1)), alpha, max_iter, tol)
+
+    return dict(zip(G.node_index, X.ravel())), info
+
+
+def personalized_pagerank(G, sources=None, alpha=0.85, max_iter=100,
+                          tol=1.0e-6):
+    '''
+    Personalized PageRank restarting at each source party, all solved at
+    once. Column j gives where switchers leaving party j tend to end up.
+
+    Inputs:
+        G: (sg.SparseGraph) the graph
+        sources: (list) source nodes. Defaults to every node
+    Returns:
+        ppr: (pd.DataFrame) scores indexed by destination node, one column
+             per source node
+        info: (dict) convergence diagnostics (see pagerank_matrix)
+    '''
+    if sources is None:
+        sources = list(G.node_index)
+    n = G.number_of_nodes()
+    cols = G.node_index.get_indexer(sources)
+    V = np.zeros((n, len(cols)))
+    V[cols, np.arange(len(cols))] = 1
+
+    X, info = pagerank_matrix(G.adj, V, alpha, max_iter, tol)
+
+    return pd.DataFrame(X, index=G.node_index, columns=sources), info
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Temporal Party Switching Network         |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Party switching network restricted to a window of years. The moves are kept
+as per-year edge deltas, so sliding the window only adds the years entering
+it and removes the years leaving it, instead of rebuilding the graph. Used
+to compute year-by-year (or election cycle) metric series.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import os, sys
+import networkx as nx
+import pandas as pd
+
+#  ________________________________________
+# |                                        |
+# |            2: Local Modules            |
+# |________________________________________|
+
+import party_switching as ps
+import network_structure as ns
+import queries as q
+import db_config as db
+
+#  ________________________________________
+# |                                        |
+# |               3: Settings              |
+# |________________________________________|
+
+os.chdir(ps.wd)
+sys.path.append(os.chdir(ps.wd))
+
+#Globals
+ELECTION_YEARS = [2001, 2002, 2006, 2010, 2011, 2014, 2016, 2018, 2020]
+
+#  ________________________________________
+# |                                        |
+# |          4: Temporal Network           |
+# |________________________________________|
+
+class TemporalNetwork:
+    '''
+    Party switching network over a [year_from, year_to] window. The graph
+    is a nx.DiGraph with the number of moves in the window as edge weight,
+    updated in place when the window moves.
+    '''
+
+    def __init__(self, db_file=db.db_file, edge_query=q.all_network,
+                 node_query=q.all_nodes):
+        '''
+        Loads the edges once and splits them into per-year deltas.
+
+        Input:
+            db_file: (str) filename for database to query
+            edge_query: (str) SQL query for edges (see network_structure)
+            node_query: (str) SQL query for nodes (see network_structure)
+        '''
+        _, df_e, df_n = ns.network_structure(db_file, edge_query, node_query,
+                                             graph=nx.DiGraph)
+        self.node_attrs = df_n
+        df_e['year'] = df_e['year'].astype(int)
+        deltas = df_e.groupby(['year', 'source', 'target']).size()
+        self.deltas = {y: d.reset_index(level=0, drop=True)
+                       for y, d in deltas.groupby(level=0)}
+        self.years = sorted(self.deltas)
+
+        self.G = nx.DiGraph()
+        self.window = None
+
+    def apply_year(self, year, sign):
+        '''
+        Adds (sign=1) or removes (sign=-1) the moves of a year from the graph.
+        Only the edges of that year are touched.
+        '''
+        if year not in self.deltas:
+            return
+        for (u, v), w in self.deltas[year].items():
+            if self.G.has_edge(u, v):
+                self.G[u][v]['weight'] += sign * w
+                if self.G[u][v]['weight'] <= 0:
+                    self.G.remove_edge(u, v)
+                    for node in {u, v}:
+                        if self.G.degree(node) == 0:
+                            self.G.remove_node(node)
+            else:
+                for node in {u, v} - set(self.G):
+                    self.G.add_node(node, **self.node_attrs.loc[node].to_dict())
+                self.G.add_edge(u, v, weight=w)
+
+    def snapshot(self, year_from, year_to):
+        '''
+        Moves the window to [year_from, year_to] and returns the graph.
+        If the new window overlaps the current one, only the years entering
+        and leaving the window are applied.
+
+        Returns:
+            G: (nx.DiGraph) network of the window. It is updated in place by
+               the next call, copy it to keep it.
+        '''
+        new = set(range(year_from, year_to + 1))
+        if self.window is None:
+            old = set()
+        else:
+            old = set(range(self.window[0], self.window[1] + 1))
+
+        if not old & new: # no overlap, start from an empty graph
+            self.G = nx.DiGraph()
+            old = set()
+        for year in sorted(old - new):
+            self.apply_year(year, -1)
+        for year in sorted(new - old):
+            self.apply_year(year, 1)
+
+        self.window = (year_from, year_to)
+        self.G.name = 'Party-Switching {}-{}'.format(year_from, year_to)
+
+        return self.G
+
+    def cycle(self, election):
+        '''
+        Returns the graph of the election cycle ending in election: the years
+        after the previous election in ELECTION_YEARS up to this one.
+        '''
+        i = ELECTION_YEARS.index(election)
+        year_from = ELECTION_YEARS[i - 1] + 1 if i > 0 else self.years[0]
+
+        return self.snapshot(year_from, election)
+
+    def sliding_windows(self, width, step=1):
+        '''
+        Windows of width years over the years with moves, every step years
+        '''
+        first, last = self.years[0], self.years[-1]
+
+        return [(y, y + width - 1) for y in range(first, last - width + 2,
+                                                  step)]
+
+    def metric_series(self, metric, windows):
+        '''
+        Computes a metric of the graph for each window, sliding the window
+        incrementally.
+
+        Inputs:
+            metric: (function) takes the graph and returns a value
+            windows: (list of tuples) (year_from, year_to) windows
+        Returns:
+            series: (pd.Series) metric values indexed by window
+        '''
+        values = {}
+        for year_from, year_to in sorted(windows):
+            values[(year_from, year_to)] = metric(self.snapshot(year_from,
+                                                                year_to))
+
+        return pd.Series(values)
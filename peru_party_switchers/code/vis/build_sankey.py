@@ -62,6 +62,12 @@ VAR_LABELS = {'univ_rec': 'University Degree', \
 'lengua_originaria': "Share of Indigenous Population (by Quartile)",\
 'sin_nivel_educ': "District Share Pop no Schooling (by Quartile)",
 "crim_rec": 'Criminal Record', None: "No Attribute Selected"}
+HOPS = 2 #Steps before and after the party of interest in multi-hop mode
+MIN_PATH_COUNT = 3 #Path steps followed by fewer candidates are pruned
+OTHER_PARTIES = 'OTHER PARTIES' #Label of the pruned path steps
+SANKEY_LAYOUT = dict(font_size=15, font=dict(color="black"), 
+                     plot_bgcolor='black', 
+                     paper_bgcolor='rgb(128, 128, 128, 0.3)')
 
 #  ________________________________________
 # |                                        |
@@ -78,13 +84,60 @@ sys.path.append( WD + GRAPH)
 # |            4: Local Modules            |
 # |________________________________________|
 
-import network_structure as ns
+import render
 
 #  ________________________________________
 # |                                        |
 # |             5: Sankey Class            |
 # |________________________________________|
 
+class LabelRegistry:
+    '''
+    Node labels of the Sankey diagram. Every label is registered once, in
+    order of appearance, with a constant time lookup of its index.
+    '''
+
+    def __init__(self, labels=()):
+        '''
+        Constructs the registry with the initial labels
+
+        Input:
+            labels: (iterable) labels registered first
+        '''
+        self.labels = []
+        self.positions = {}
+        for label in labels:
+            self.index(label)
+
+    def index(self, label):
+        '''
+        Index of a label, registering it if new
+        '''
+        if label not in self.positions:
+            self.positions[label] = len(self.labels)
+            self.labels.append(label)
+
+        return self.positions[label]
+
+    def indexes(self, labels):
+        '''
+        Indexes of a sequence of labels, registering the new ones in order of
+        appearance
+        Inputs:
+            labels: (array-like) labels
+        Returns:
+            (np.array) the index of every label
+        '''
+        labels = pd.Series(labels)
+        for label in labels.unique():
+            self.index(label)
+
+        return labels.map(self.positions).values
+
+    def __len__(self):
+        return len(self.labels)
+
+
 class Sankey:
     '''
     Sankey will create the inputs for and plot the diagram given the data
@@ -121,9 +174,11 @@ class Sankey:
                 self.attr_of_interest = 1
             else:
                 self.attr_of_interest = 0
-        self.labels = [self.poi]
+        self.registry = LabelRegistry([self.poi])
+        self.labels = self.registry.labels
         self.values, self.sources, self.targets = [], [], []
-        self.node_colors = self.gen_color_palette(len(self.data))
+        #Party nodes are separated by in and out flows
+        self.node_colors = self.gen_color_palette(2 * len(self.data))
         self.flow_colors = []
         self.title = "{} flows by {}".format(self.poi, VAR_LABELS[self.attribute])
         
@@ -153,13 +208,26 @@ class Sankey:
 
         return color_palette
 
-    def gen_inputs_from_data(self, incoming=True):
+    def gen_inputs_from_data(self):
+        '''
+        Builds the source, target, values and flow colors lists, first for the
+        party switchers flowing into the party of interest and then for the
+        ones flowing out of it.
+        Returns:
+            None
+        '''
+        for incoming in [True, False]:
+            self.gen_flows(incoming)
+        if not self.binary:
+            self.flow_colors = None
+
+    def gen_flows(self, incoming):
         '''
         For each individual party node, groups flows by attribute for party
-        switchers flowing into and out of the party of interest. Loops through
-        the dataframe to update the source, target, labels, and values list
-        attributes in place. Finally, creates the flow of politicians between 
-        the attribute groups and the party of interest.
+        switchers flowing into or out of the party of interest, and the flows
+        between the attribute groups and the party of interest. The flows are
+        aggregated with a groupby over the dataframe, so every link appears
+        once.
         Inputs:
             incoming: (boolean) specifies if politician switching into or out from
                       the party of interest
@@ -167,77 +235,70 @@ class Sankey:
             None
         '''
         if incoming:
-            row, col = 'source', 'target'
-
+            row = 'source'
         else:
-            row, col = 'target', 'source'
-        drop_idx = self.data[self.data[row] == self.poi].index
-        iterator = self.data.drop(index=drop_idx, columns=[col])
-        
-        for _, party, attr, count in iterator.itertuples():
-            #Creates party node flows to and from grouping nodes 
-            if incoming:
-                source, target = self.target_source_labels(incoming, party, attr)
-            else:
-                target, source = self.target_source_labels(incoming, party, attr)
-            self.sources.append(self.labels.index(source))
-            self.targets.append(self.labels.index(target))
-            self.values.append(count)
-            if not self.attribute:
-                self.flow_colors = None
-            #Creates flows for grouping nodes to and from party of interest node
-            else:
-                self.values.append(count)
-                group_label = self.grouping_label(attr, incoming)
-                group_index = self.labels.index(group_label)
-                self.node_colors[group_index] = "gray"
-                if incoming:
-                    self.sources.append(group_index)
-                    self.targets.append(0)
-                else:
-                    self.sources.append(0)
-                    self.targets.append(group_index)
-                if self.binary:
-                    if attr != self.attr_of_interest:
-                        self.flow_colors.append('rgba(235, 235, 235, .5)') #gray
-                    else:
-                        self.flow_colors.append('rgba(214, 30, 30, .8)') #red
-                else:
-                    self.flow_colors = None
-        if incoming:
-            self.gen_inputs_from_data(incoming=False)
-
-    def target_source_labels(self, incoming, party, attr):
+            row = 'target'
+        df = self.data.loc[self.data[row] != self.poi]
+        attr_col, count_col = self.data.columns[2], self.data.columns[3]
+
+        #allows identical party nodes to be separated by in and out flows
+        party = df[row] if incoming else df[row] + " "
+        if self.attribute:
+            group_labels = {a: self.grouping_label(a, incoming) \
+                            for a in df[attr_col].unique()}
+            group = df[attr_col].map(group_labels)
+        else:
+            group = pd.Series(self.poi, index=df.index)
+
+        #Labels in the order they appear: party, then its grouping node
+        self.registry.indexes(np.column_stack([party.values, group.values]). \
+                              ravel())
+        flows = pd.DataFrame({'party': self.registry.indexes(party),
+                              'group': self.registry.indexes(group),
+                              'attr': df[attr_col].values,
+                              'count': df[count_col].values})
+
+        #Creates party node flows to and from grouping nodes 
+        links = flows.groupby(['party', 'group'], sort=False). \
+                      agg(attr=('attr', 'first'), count=('count', 'sum')). \
+                      reset_index()
+        self.add_links(links['party'], links['group'], links, incoming)
+
+        #Creates flows for grouping nodes to and from party of interest node
+        if self.attribute:
+            links = flows.groupby('group', sort=False). \
+                          agg(attr=('attr', 'first'), count=('count', 'sum')). \
+                          reset_index()
+            for g in links['group']:
+                self.node_colors[g] = "gray"
+            poi = pd.Series(0, index=links.index)
+            self.add_links(links['group'], poi, links, incoming)
+
+    def add_links(self, outer, inner, links, incoming):
         '''
-        Constructs labels for source and target nodes
+        Appends the links between the outer nodes (farther from the party of
+        interest) and the inner nodes, with their values and colors
         Inputs:
-            incoming: (boolean) specifies if politician switching into or out from
-                      the party of interest
-            party: (string) the name of the party from or into which the politician
-                    is switching
-            attr: (integer) the value of attribute of interest
+            outer, inner: (pd.Series) node indexes
+            links: (pd.DataFrame) attribute value ('attr') and count of the
+                   links
+            incoming: (boolean) links flow from the outer to the inner nodes
         Returns:
-            party: (string) party name which may be slight modified
-            target_source: (string) party name which will be used either as a
-                            source or target node
+            None
         '''
-        if not incoming: #allows identical party nodes to be separated by in and out flows
-            party += " "
-        self.labels.append(party)
-        if not self.attribute:
-            target_source = self.poi
+        if incoming:
+            sources, targets = outer, inner
         else:
-            target_source = self.grouping_label(attr, incoming)
-            if target_source not in self.labels:
-                self.labels.append(target_source)
-            if self.binary:
-                if attr != self.attr_of_interest:
-                    self.flow_colors.append('rgba(235, 235, 235, .5)') #gray
-                else:
-                    self.flow_colors.append('rgba(214, 30, 30, .8)') #red
-                    
-        return party, target_source
-                    
+            sources, targets = inner, outer
+        self.sources.extend(sources.tolist())
+        self.targets.extend(targets.tolist())
+        self.values.extend(links['count'].tolist())
+        if self.binary:
+            self.flow_colors.extend(np.where(
+                links['attr'] != self.attr_of_interest,
+                'rgba(235, 235, 235, .5)', #gray
+                'rgba(214, 30, 30, .8)').tolist()) #red
+
     def grouping_label(self, attr, incoming):
         '''
         Creates the label for the grouping nodes
@@ -261,13 +322,13 @@ class Sankey:
             
         return group_label
 
-    def plot_diagram(self):
+    def figure(self):
         '''
         Given complete attribute lists for labels, colors, sources, targets,
-        values, and flow colors, plots the Sankey diagram in an offline window.
+        values, and flow colors, builds the plotly figure of the diagram.
 
         Returns:
-            None
+            fig: (go.Figure) the Sankey diagram
         '''
 
         fig = go.Figure(data=[go.Sankey(
@@ -284,12 +345,85 @@ class Sankey:
                 value=self.values,
                 color=self.flow_colors))])
 
-        fig.update_layout(title_text=self.title, font_size=15,
-                          font=dict(color="black"),
-                          plot_bgcolor='black',
-                          paper_bgcolor='rgb(128, 128, 128, 0.3)')
+        fig.update_layout(title_text=self.title, **SANKEY_LAYOUT)
 
-        fig.show()
+        return fig
+
+    def plot_diagram(self, file=None):
+        '''
+        Plots the Sankey diagram in an offline window. In headless mode (see
+        render.headless) nothing is opened: the diagram is written as an HTML
+        page.
+
+        Input:
+            file: (str) path of the HTML page. None to return its contents
+                  when headless
+        Returns:
+            (str or bytes) the path of the page, or the page bytes when
+            headless and file is None
+        '''
+        fig = self.figure()
+
+        rv = None
+        if file is not None:
+            fig.write_html(file, auto_open=False)
+            rv = file
+        elif render.HEADLESS:
+            rv = fig.to_html().encode('utf-8')
+
+        if not render.HEADLESS:
+            fig.show()
+
+        return rv
+
+
+class MultiHopSankey(Sankey):
+    '''
+    Multi-hop Sankey diagram: the trajectories of the candidates through the
+    party of interest, up to a number of steps before joining it and after
+    leaving it. Every party gets a node at each step.
+    '''
+
+    def __init__(self, links, hops, party_of_interest):
+        '''
+        Constructs the diagram inputs from the aggregated links
+
+        Input:
+            links: (Pandas Dataframe) flows between consecutive steps, with
+                the step and party label of both ends and the count (see
+                path_links)
+            hops: (integer) number of steps before and after the party of
+                interest
+            party_of_interest: (string) the party around which the diagram
+                is centered
+        '''
+        self.poi = party_of_interest
+        self.hops = hops
+        self.attribute_range = []
+        self.registry = LabelRegistry([(0, self.poi)])
+        self.sources = self.registry.indexes(list(zip(
+            links['source_step'], links['source']))).tolist()
+        self.targets = self.registry.indexes(list(zip(
+            links['target_step'], links['target']))).tolist()
+        self.values = links['count'].tolist()
+        self.labels = [label for _, label in self.registry.labels]
+        self.node_colors = self.gen_node_colors()
+        self.flow_colors = None
+        self.title = "{} trajectories, {} steps before and after".format( \
+                     self.poi, hops)
+
+    def gen_node_colors(self):
+        '''
+        Colors the nodes, with the same random color for a party at every
+        step and the party of interest in green
+        Returns:
+            (list) a color per node
+        '''
+        parties = sorted(set(self.labels))
+        palette = dict(zip(parties, self.gen_color_palette(len(parties))[1:]))
+        palette[self.poi] = "green"
+
+        return [palette[label] for label in self.labels]
 
 
 #  ________________________________________
@@ -316,8 +450,9 @@ def gen_party_indexer(DB_FILE):
 
 def build_query(poi, attribute):
     '''
-    Constructs a SQL query that will include id_hdv, source party, target party,
-    year of switch, and the specified attribute.
+    Constructs a SQL query that reads the slice of the sankey flow cube with
+    the flows into and out of the party of interest, split by the specified
+    attribute.
 
     Input:
         poi: (integer) the index of the party upon which the Sankey will focus
@@ -327,38 +462,38 @@ def build_query(poi, attribute):
     Output:
         query: (string) a SQL query
     '''
-    if not attribute:
-        attribute_string = ' '
-    else:
-        attribute_string = ", sv.{} ".format(attribute)
 
-    query = ('SELECT c.id_hdv, n.source, n.target, n.year' + attribute_string +\
-             'FROM network as n JOIN candidate as c on n.id_hdv = c.id_hdv '
-             'JOIN sankey_vars as sv on sv.id_hdv = c.id_hdv '
-             'WHERE n.source = {} OR n.target = {}'.format(poi, poi))
+    query = ('SELECT direction, counterpart, attr_value, count '
+             'FROM sankey_flows '
+             'WHERE party = {} AND attribute = "{}"'.format(poi, attribute))
 
     return query
 
-def clean_df(df, poi, indexer):
+def clean_df(df, poi, indexer, attribute):
     '''
-    Takes a raw data frame and outputs it in the correct format for the Sankey
-    inputs.
+    Takes a slice of the sankey flow cube and outputs it in the correct format
+    for the Sankey inputs.
 
     Input:
-        df: (Pandas data frame) raw data frame
+        df: (Pandas data frame) slice of the flow cube
         poi: (integer) the index of the party on which the Sankey is focused
+        indexer: (dict) maps party indices to party names
+        attribute: (string) the attribute on which party switching will be
+            characterized
 
     Output:
         cleaned_df: (Pandas data frame) the dataframe in a suitable format for
             the Sankey diagram
     '''
-    if len(df.columns) == 4:
-        df['dummy'] = ''
-    attr = df.columns[4] #empty string if no attr, else gets the attr
-    df = df.groupby(['source', 'target', attr]).size().reset_index()
-    df.rename(columns={df.columns[3]: "Count"}, inplace=True)
-    df = df[(df.source != poi) | (df.target != poi)]
-    # gets rid of non-party switchers from poi
+    attr = attribute if attribute else 'dummy'
+    incoming = df['direction'] == 'in'
+    df['source'] = np.where(incoming, df['counterpart'], poi)
+    df['target'] = np.where(incoming, poi, df['counterpart'])
+    df = df.rename(columns={'attr_value': attr, 'count': 'Count'})
+    if not attribute:
+        df[attr] = ''
+    df = df[['source', 'target', attr, 'Count']]
+    df = df.sort_values(['source', 'target', attr]).reset_index(drop=True)
 
     if attr in ['crim_rec', 'univ_rec']:
         df[attr] = df[attr].astype(float).astype(int)
@@ -376,33 +511,172 @@ def clean_df(df, poi, indexer):
 
     return df
 
+def trajectory_paths(moves, poi, hops=HOPS):
+    '''
+    Enumerates the paths of the candidates through the party of interest
+    with sorted arrays: the moves are sorted by candidate and year, so the
+    steps before a visit to the party are the sources of the previous moves
+    and the steps after are the targets of the next ones, as long as they
+    belong to the same candidate.
+
+    Input:
+        moves: (Pandas data frame) network moves (id_hdv, source, target,
+            year)
+        poi: (integer) the index of the party of interest
+        hops: (integer) number of steps before and after the party
+    Output:
+        paths: (Pandas data frame) one row per visit to the party, with the
+            party at every step from -hops to hops (-1 when the trajectory
+            is shorter)
+    '''
+    moves = moves.loc[moves['source'] != moves['target']]
+    moves = moves.sort_values(['id_hdv', 'year'], kind='mergesort')
+    ids = pd.factorize(moves['id_hdv'])[0]
+    src = moves['source'].values.astype(np.int64)
+    tgt = moves['target'].values.astype(np.int64)
+    n = len(ids)
+    first = np.r_[True, ids[1:] != ids[:-1]]
+
+    # Visits: moves into the party, and trajectories starting in it
+    arrivals = np.flatnonzero(tgt == poi)
+    starts = np.flatnonzero(first & (src == poi))
+    before = np.r_[arrivals, np.full(len(starts), -1)]
+    after = np.r_[arrivals + 1, starts]
+    visit = ids[np.r_[arrivals, starts]]
+
+    paths = {0: np.full(len(visit), poi)}
+    valid_before = before >= 0
+    valid_after = np.ones(len(visit), dtype=bool)
+    for k in range(1, hops + 1):
+        i = before - (k - 1)
+        valid_before &= (i >= 0) & (ids[np.clip(i, 0, n - 1)] == visit)
+        paths[-k] = np.where(valid_before, src[np.clip(i, 0, n - 1)], -1)
+        j = after + (k - 1)
+        valid_after &= (j < n) & (ids[np.clip(j, 0, n - 1)] == visit)
+        paths[k] = np.where(valid_after, tgt[np.clip(j, 0, n - 1)], -1)
+
+    return pd.DataFrame(paths)[list(range(-hops, hops + 1))]
+
+
+def path_links(paths, indexer, min_count=MIN_PATH_COUNT):
+    '''
+    Aggregates the paths into links between consecutive steps. Each half
+    of the paths (before and after the party) is pruned from the party
+    outwards: a step shared by fewer than min_count candidates, counting
+    the path from the party up to it, is grouped into OTHER_PARTIES. The
+    pruned flows are kept, and the links always lead back to the party.
+
+    Input:
+        paths: (Pandas data frame) paths, as in trajectory_paths
+        indexer: (dict) maps party indices to party names
+        min_count: (integer) minimum number of candidates of a path step
+    Output:
+        links: (Pandas data frame) source_step, source, target_step, target
+            and count of every link
+    '''
+    steps = list(paths.columns)
+
+    #Groups all regional parties into one group, except the party of interest
+    names = {0: pd.Series(indexer)}
+    names['other'] = names[0].where(~names[0].str.startswith("MR/D"), \
+                                    "REGIONAL PARTY")
+    paths = pd.DataFrame({k: paths[k].map(names.get(k, names['other'])) \
+                          for k in steps}) #Missing steps are NaN
+
+    for side in [-1, 1]:
+        for k in range(1, max(steps) + 1):
+            half = [side * i for i in range(k + 1)]
+            valid = paths[side * k].notna()
+            count = paths.loc[valid].groupby(half)[side * k].transform('count')
+            paths.loc[count.index[count < min_count], side * k] = OTHER_PARTIES
+
+    links = []
+    for a, b in zip(steps[:-1], steps[1:]):
+        hop = paths.dropna(subset=[a, b]).groupby([a, b], sort=False).size()
+        hop = hop.reset_index(name='count')
+        links.append(pd.DataFrame({'source_step': a,
+                                   'source': hop[a].values,
+                                   'target_step': b,
+                                   'target': hop[b].values,
+                                   'count': hop['count'].values}))
+
+    return pd.concat(links, ignore_index=True)
+
+
+def build_paths_query():
+    '''
+    Constructs a SQL query that reads the moves of the network
+
+    Output:
+        query: (string) a SQL query
+    '''
+
+    query = ('SELECT id_hdv, source, target, year '
+             'FROM network '
+             'WHERE source != target')
+
+    return query
+
 #  ________________________________________
 # |                                        |
 # |           7: Wrapper Function          |
 # |________________________________________|
 
-def sankey_wrapper(party_of_interest, attribute):
+def sankey_wrapper(party_of_interest, attribute, file=None):
     '''
-    Given inputs from the shell, creates a query for the Sankey Attribute table,
-    converts the output into a Pandas Dataframe, creates a Sankey object with
-    the Dataframe, which in turns builds and plots the Sankey diagram.
+    Given inputs from the shell, reads the slice of the sankey flow cube for
+    the party and attribute, creates a Sankey object with the Dataframe, which
+    in turns builds and plots the Sankey diagram.
 
     Inputs:
         party_of_interest: (integer) the number of the party around which the
             Sankey diagram will be centered
         attribute: (string) the attribute upon which the sankey will divide
             the node flows
+        file: (str) path of the HTML page (see Sankey.plot_diagram)
     Output:
-        None, function will plot diagram in an offline internet window
+        Plots the diagram in an offline internet window. Headless, returns
+        the path or the bytes of the HTML page
     '''
 
     query = build_query(party_of_interest, attribute)
-    df = ns.network_structure(DB_FILE, query, '', None, edge_only=True)
+    conn = sqlite3.connect(DB_FILE)
+    df = pd.read_sql(query, conn)
+    conn.close()
     indexer = gen_party_indexer(DB_FILE)
-    sankey_df = clean_df(df, party_of_interest, indexer)
+    sankey_df = clean_df(df, party_of_interest, indexer, attribute)
 
     poi = indexer[party_of_interest]
 
     sankey = Sankey(sankey_df, attribute, poi)
-    sankey.plot_diagram()
+    return sankey.plot_diagram(file)
+
+
+def multi_hop_wrapper(party_of_interest, hops=HOPS, min_count=MIN_PATH_COUNT,
+                      file=None):
+    '''
+    Builds and plots the multi-hop Sankey diagram of a party: where the
+    candidates were before joining it and where they went after leaving it.
+
+    Inputs:
+        party_of_interest: (integer) the number of the party around which the
+            Sankey diagram will be centered
+        hops: (integer) number of steps before and after the party (2 or 3)
+        min_count: (integer) path steps followed by fewer candidates are
+            grouped into OTHER_PARTIES (see path_links)
+        file: (str) path of the HTML page (see Sankey.plot_diagram)
+    Output:
+        Plots the diagram in an offline internet window. Headless, returns
+        the path or the bytes of the HTML page
+    '''
+
+    conn = sqlite3.connect(DB_FILE)
+    moves = pd.read_sql(build_paths_query(), conn)
+    conn.close()
+    indexer = gen_party_indexer(DB_FILE)
+
+    paths = trajectory_paths(moves, party_of_interest, hops)
+    links = path_links(paths, indexer, min_count)
 
+    sankey = MultiHopSankey(links, hops, indexer[party_of_interest])
+    return sankey.plot_diagram(file)
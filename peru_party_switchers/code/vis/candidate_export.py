@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Candidate Trajectory Export              |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Batch export of the trajectory graph of every candidate in candidate_menu,
+one image per id_hdv. The network, its layout and the background of the
+candidate graph (at the resolution of the images) are loaded and rendered
+once, and shared read-only with a pool of headless (Agg) workers that only
+draw the path of each candidate over it.
+Images are written to a temporary file and renamed when complete, and the
+candidates that already have an image are skipped, so an interrupted export
+can be restarted. Ids are turned into flat file names (2/1/2001 is saved as
+2-1-2001.png), and a candidate that fails is recorded, with its error, in
+the results while the rest of the export goes on.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import os, sys
+import re
+import time
+import sqlite3
+import multiprocessing as mp
+import pandas as pd
+import networkx as nx
+
+#  ________________________________________
+# |                                        |
+# |            2: Local Modules            |
+# |________________________________________|
+
+import party_switching as ps
+import network_structure as ns
+import total_graph as tg
+import render
+import queries as q
+import db_config as db
+
+#  ________________________________________
+# |                                        |
+# |               3: Settings              |
+# |________________________________________|
+
+os.chdir(ps.wd)
+sys.path.append(os.chdir(ps.wd))
+
+#Globals
+EXPORT_DIR = 'output/candidates'
+EXPORT_DPI = 250 #Resolution of the images and of their background
+WORKER_DATA = None #Background of the candidate graph shared by the workers
+
+#  ________________________________________
+# |                                        |
+# |           4: Helper Functions          |
+# |________________________________________|
+
+def image_name(id_hdv, taken=()):
+    '''
+    File name of the image of a candidate. The characters of the id that
+    cannot be part of a file name (like the slashes of 2/1/2001) are
+    replaced by "-", and a suffix is added if the name is already taken by
+    another candidate.
+
+    Input:
+        id_hdv: (str) id of the candidate
+        taken: (set) names already given to other candidates
+    Output:
+        name: (str) file name of the image
+    '''
+    stem = re.sub(r'[^\w.-]', '-', str(id_hdv))
+    name = '{}.png'.format(stem)
+    n = 1
+    while name in taken:
+        name = '{}_{}.png'.format(stem, n)
+        n += 1
+
+    return name
+
+
+def candidate_tasks(df_e, out_dir, overwrite=False):
+    '''
+    One task per candidate of candidate_menu, with its moves and trajectory,
+    leaving out the candidates already exported
+
+    Input:
+        df_e: (pd.DataFrame) edges of the network (id_hdv, source, target)
+        out_dir: (str) output directory
+        overwrite: (bool) export again the existing images
+    Output:
+        tasks: (list) (id_hdv, name, nodes, edges, path, file) tuples
+        skipped: (int) number of candidates already exported
+    '''
+    conn = sqlite3.connect(db.db_file)
+    names = pd.read_sql_query(q.candidate_names, conn)
+    moves = pd.read_sql_query(q.candidate_moves, conn)
+    conn.close()
+
+    edges = {i: list(g[['source', 'target']].itertuples(index=False,
+                                                        name=None))
+             for i, g in df_e.groupby('id_hdv')}
+    paths = {i: tg.format_trajectory(g) for i, g in moves.groupby('id_hdv')}
+
+    tasks = []
+    skipped = 0
+    taken = set()
+    for id_hdv, name in names.itertuples(index=False, name=None):
+        image = image_name(id_hdv, taken)
+        taken.add(image)
+        file = os.path.join(out_dir, image)
+        if not overwrite and os.path.exists(file):
+            skipped += 1
+            continue
+        cand_edges = edges.get(id_hdv, [])
+        cand_nodes = set(n for e in cand_edges for n in e)
+        tasks.append((id_hdv, name, cand_nodes, cand_edges,
+                      paths.get(id_hdv, ''), file))
+
+    return tasks, skipped
+
+#  ________________________________________
+# |                                        |
+# |              5: Workers                |
+# |________________________________________|
+
+def init_worker(data, headless=True):
+    '''
+    Receives the background once per worker, switching it to the non
+    interactive backend
+    '''
+    global WORKER_DATA
+    WORKER_DATA = data
+    if headless:
+        render.headless()
+
+
+def render_candidate(task):
+    '''
+    Draws and saves the trajectory graph of one candidate, reusing the
+    canvas of the worker. The image is renamed to its final name only when
+    completely written. A failure is returned as the error of the task
+    (without file), so that it does not stop the export.
+    '''
+    base = WORKER_DATA
+    id_hdv, name, cand_nodes, cand_edges, path, file = task
+
+    start = time.time()
+    tmp = file + '.tmp'
+    try:
+        image = tg.candidate_image(base, cand_nodes, cand_edges, name, path)
+        render.write_image(image, tmp, dpi=base['dpi'])
+        os.replace(tmp, file)
+    except Exception as e:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return id_hdv, None, time.time() - start, \
+               '{}: {}'.format(type(e).__name__, e)
+
+    return id_hdv, file, time.time() - start, None
+
+#  ________________________________________
+# |                                        |
+# |               6: Export                |
+# |________________________________________|
+
+def export_candidates(out_dir=EXPORT_DIR, processes=None, dpi=EXPORT_DPI,
+                      overwrite=False):
+    '''
+    Exports the trajectory graph of every candidate in candidate_menu
+
+    Input:
+        out_dir: (str) output directory, one image per id_hdv
+        processes: (int) number of workers. Defaults to the number of CPUs,
+                   1 runs in this process
+        dpi: (int) resolution of the images
+        overwrite: (bool) export again the images from a previous run
+    Output:
+        results: (pd.DataFrame) id_hdv, file, seconds and error (None when
+                 the image was written) of every candidate exported
+    '''
+    start = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+
+    DG, df_e, df_n = ns.network_structure(db.db_file, q.all_network, \
+                                          q.all_nodes, graph = nx.DiGraph)
+    base = tg.candidate_base(DG, df_n, dpi)
+    tasks, skipped = candidate_tasks(df_e, out_dir, overwrite)
+    setup = time.time() - start
+
+    if processes is None:
+        processes = mp.cpu_count()
+
+    start = time.time()
+    if processes <= 1 or len(tasks) <= 1:
+        init_worker(base, headless=False)
+        results = [render_candidate(t) for t in tasks]
+    else:
+        chunksize = max(1, len(tasks) // (processes * 4))
+        with mp.Pool(processes, initializer=init_worker,
+                     initargs=(base,)) as pool:
+            results = list(pool.imap_unordered(render_candidate, tasks,
+                                               chunksize))
+    elapsed = time.time() - start
+
+    results = pd.DataFrame(results, columns=['id_hdv', 'file', 'seconds',
+                                             'error'])
+    failed = results.dropna(subset=['error'])
+    written = len(results) - len(failed)
+
+    print('Setup (graph, layout and background): {:.1f}s'.format(setup))
+    print('Exported {} images in {:.1f}s ({:.2f} images/s), {} already '
+          'exported, {} failed'.format(written, elapsed,
+                                       written / max(elapsed, 1e-9),
+                                       skipped, len(failed)))
+    for id_hdv, error in failed[['id_hdv', 'error']].itertuples(index=False,
+                                                                  name=None):
+        print('  {}: {}'.format(id_hdv, error))
+
+    return results
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Barnes-Hut Force Directed Layout         |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Force directed layout with the forces of nx.spring_layout (Fruchterman-
+Reingold), where the repulsion between all the pairs of nodes is
+approximated with a Barnes-Hut quadtree: distant groups of nodes act as a
+single mass at their center. The quadtree is built and traversed level by
+level with vectorized NumPy, so every iteration is O(n log n) instead of
+O(n^2). barnes_hut_layout takes the same arguments as nx.spring_layout, so
+it can replace it in the hierarchical layout of nodes_coordinates.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import time
+import numpy as np
+import scipy.sparse as sp
+
+#  ________________________________________
+# |                                        |
+# |              2: Quadtree               |
+# |________________________________________|
+
+def quadtree(X, depth):
+    '''
+    Quadtree of the positions, one entry per level (the root is level 0).
+
+    Input:
+        X: (np.array) n x 2 positions
+        depth: (int) deepest level
+    Output:
+        levels: (list of dicts) for every level, the cell of every node
+                ('cell'), the mass, center of mass and size of the cells,
+                and the children of every cell of the previous level
+                ('order' and 'ptr', CSR style)
+    '''
+    lo = X.min(axis=0)
+    span = max((X.max(axis=0) - lo).max(), 1e-9)
+    side = 1 << depth
+    grid = np.minimum(((X - lo) / span * side).astype(np.int64), side - 1)
+
+    levels = []
+    parent_keys = None
+    for l in range(depth + 1):
+        g = grid >> (depth - l)
+        keys, cell = np.unique(g[:, 0] * (1 << l) + g[:, 1],
+                               return_inverse=True)
+        mass = np.bincount(cell)
+        com = np.stack([np.bincount(cell, X[:, 0]),
+                        np.bincount(cell, X[:, 1])], axis=1) / mass[:, None]
+        level = {'cell': cell, 'mass': mass, 'com': com,
+                 'size': span / (1 << l)}
+
+        if parent_keys is not None:
+            # Parent of each cell: halve its grid coordinates
+            gx, gy = keys >> l, keys & ((1 << l) - 1)
+            parent = np.searchsorted(parent_keys,
+                                     (gx >> 1) * (1 << (l - 1)) + (gy >> 1))
+            level['order'] = np.argsort(parent, kind='stable')
+            level['ptr'] = np.concatenate([[0], np.cumsum(
+                np.bincount(parent, minlength=len(parent_keys)))])
+        levels.append(level)
+        parent_keys = keys
+
+    return levels
+
+
+def repulsion(X, k, theta, depth):
+    '''
+    Barnes-Hut approximation of the repulsive displacement k^2 / d^2 * delta
+    of every node. The (node, cell) pairs are traversed from the root: a
+    pair is accepted when the cell does not contain the node and is small
+    compared to its distance (size / d < theta), otherwise it is replaced by
+    the pairs of the node with the children of the cell.
+    '''
+    n = X.shape[0]
+    levels = quadtree(X, depth)
+    disp = np.zeros((n, 2))
+    node = np.arange(n)
+    cell = np.zeros(n, dtype=np.int64)
+
+    for l, level in enumerate(levels):
+        own = level['cell'][node] == cell
+        mass = level['mass'][cell].astype(float)
+        com = level['com'][cell]
+        if l == depth:
+            # Deepest level: exact, leaving the node itself out of its cell
+            com = np.where(own[:, None], (com * mass[:, None] - X[node]) /
+                           np.maximum(mass - 1, 1)[:, None], com)
+            mass = np.where(own, mass - 1, mass)
+            accept = mass > 0
+        else:
+            delta = X[node] - com
+            dist = np.sqrt((delta ** 2).sum(axis=1))
+            accept = ~own & ((mass == 1) | (level['size'] < theta * dist))
+
+        delta = X[node[accept]] - com[accept]
+        dist2 = np.maximum((delta ** 2).sum(axis=1), 1e-8)
+        f = delta * (mass[accept] * k * k / dist2)[:, None]
+        disp[:, 0] += np.bincount(node[accept], f[:, 0], minlength=n)
+        disp[:, 1] += np.bincount(node[accept], f[:, 1], minlength=n)
+
+        if l == depth:
+            break
+        # Open the remaining cells
+        node, cell = node[~accept], cell[~accept]
+        child = levels[l + 1]
+        count = child['ptr'][cell + 1] - child['ptr'][cell]
+        start = np.repeat(child['ptr'][cell], count)
+        offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count,
+                                                     count)
+        node = np.repeat(node, count)
+        cell = child['order'][start + offset]
+
+    return disp
+
+#  ________________________________________
+# |                                        |
+# |            3: Layout Engine            |
+# |________________________________________|
+
+def force_layout(A, X, k=None, iterations=50, theta=0.8, timing=None,
+                 temperature=0.1):
+    '''
+    Fruchterman-Reingold iterations, as in nx.spring_layout, with the
+    Barnes-Hut repulsion.
+
+    Input:
+        A: (sp.csr_matrix) symmetric weighted adjacency
+        X: (np.array) n x 2 initial positions
+        k: (float) optimal distance between nodes. Defaults to 1/sqrt(n)
+        iterations: (int) number of iterations
+        theta: (float) Barnes-Hut opening criterion (0 is exact)
+        timing: (list) if given, the seconds of every iteration are appended
+        temperature: (float) largest initial step, as a share of the width
+                     of the layout. Small values refine a warm start
+    Output:
+        X: (np.array) final positions
+    '''
+    n = X.shape[0]
+    if n < 2:
+        return X
+    if k is None:
+        k = np.sqrt(1.0 / n)
+    depth = int(min(16, max(4, np.ceil(np.log2(n)) + 2)))
+
+    coo = sp.triu(A, k=1).tocoo()
+    t = max(X.max(axis=0) - X.min(axis=0)) * temperature
+    dt = t / (iterations + 1)
+
+    for _ in range(iterations):
+        start = time.time()
+        disp = repulsion(X, k, theta, depth)
+
+        # Attraction along the edges: A * d / k * delta
+        delta = X[coo.row] - X[coo.col]
+        f = delta * (coo.data * np.sqrt((delta ** 2).sum(axis=1)) / k)\
+            [:, None]
+        for dim in range(2):
+            disp[:, dim] -= np.bincount(coo.row, f[:, dim], minlength=n)
+            disp[:, dim] += np.bincount(coo.col, f[:, dim], minlength=n)
+
+        length = np.sqrt((disp ** 2).sum(axis=1))
+        length = np.where(length < 0.01, 0.1, length)
+        X = X + disp * (t / length)[:, None]
+        t -= dt
+
+        if timing is not None:
+            timing.append(time.time() - start)
+
+    return X
+
+
+def rescale(X, scale=1):
+    '''
+    Centers the positions and scales them so the largest coordinate is
+    scale, as nx.rescale_layout
+    '''
+    X = X - X.mean(axis=0)
+    lim = np.abs(X).max()
+    if lim > 0:
+        X = X * scale / lim
+
+    return X
+
+
+def barnes_hut_layout(G, k=None, pos=None, iterations=50, weight='weight',
+                      scale=1, seed=None, theta=0.8, timing=None,
+                      temperature=0.1):
+    '''
+    Drop-in alternative to nx.spring_layout using the Barnes-Hut engine.
+
+    Input:
+        G: (nx.Graph or nx.DiGraph) the graph. Directed edges attract both
+           ends
+        k, pos, iterations, weight, scale, seed: as in nx.spring_layout
+        theta: (float) Barnes-Hut opening criterion
+        timing: (list) if given, the seconds of every iteration are appended
+        temperature: (float) largest initial step (see force_layout)
+    Output:
+        pos: (dict) position (np.array) of every node
+    '''
+    nodes = list(G)
+    n = len(nodes)
+    if n == 0:
+        return {}
+    if n == 1:
+        return {nodes[0]: np.zeros(2)}
+
+    index = {v: i for i, v in enumerate(nodes)}
+    edges = [(index[u], index[v], d.get(weight, 1) if weight else 1) \
+             for u, v, d in G.edges(data=True)]
+    A = sp.csr_matrix((n, n))
+    if edges:
+        r, c, w = (np.array(x) for x in zip(*edges))
+        A = sp.csr_matrix((w.astype(float), (r, c)), shape=(n, n))
+        A = A + A.T
+
+    X = np.random.RandomState(seed).rand(n, 2)
+    if pos is not None:
+        for i, v in enumerate(nodes):
+            if v in pos:
+                X[i] = pos[v]
+    X = force_layout(A, X, k, iterations, theta, timing, temperature)
+    X = rescale(X, scale)
+
+    return dict(zip(nodes, X))
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Interactive Network Export               |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Exports the full network as a standalone interactive HTML page (canvas, no
+external libraries) using the stored ini_x/ini_y and clu_x/clu_y
+coordinates. Zoomed out, the page draws the clusters and the aggregated
+cluster edges (com_network weights). Past a zoom threshold it draws the
+individual party edges. Nodes and edges are embedded as compact binary
+arrays (base64 typed arrays). The party edges are decoded only the first
+time they are needed, so the page opens instantly even with very large edge
+counts.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import os, sys
+import base64
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+import networkx as nx
+import matplotlib.pyplot as plt
+
+#  ________________________________________
+# |                                        |
+# |            2: Local Modules            |
+# |________________________________________|
+
+import party_switching as ps
+import network_structure as ns
+import queries as q
+import db_config as db
+
+#  ________________________________________
+# |                                        |
+# |               3: Settings              |
+# |________________________________________|
+
+os.chdir(ps.wd)
+sys.path.append(os.chdir(ps.wd))
+
+#Globals
+HTML_FILE = 'output/network.html'
+LOD_ZOOM = 3 #Zoom from which the party edges replace the cluster edges
+
+#  ________________________________________
+# |                                        |
+# |           4: Helper Functions          |
+# |________________________________________|
+
+def encode(values, dtype):
+    '''
+    Base64 of the little endian bytes of an array, to be read in the page as
+    a typed array
+    '''
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype). \
+                            tobytes()).decode('ascii')
+
+
+def index_dtype(n):
+    '''
+    Smallest unsigned type (numpy and JavaScript names) for n indexes
+    '''
+    if n < 2 ** 16:
+        return '<u2', 'Uint16Array'
+    return '<u4', 'Uint32Array'
+
+
+def colors(n):
+    '''
+    Cluster colors, as in total_graph (tab20)
+    '''
+    return ['#{:02x}{:02x}{:02x}'.format(*[int(255 * c) for c in rgba[:3]]) \
+            for rgba in plt.cm.tab20(np.arange(n) % 20)]
+
+
+def node_payload(df_n):
+    '''
+    Positions, cluster and degree of the parties, with their names
+    '''
+    return {'x': encode(df_n['ini_x'], '<f4'),
+            'y': encode(df_n['ini_y'], '<f4'),
+            'cluster': encode(df_n['clusters'], '<u2'),
+            'degree': encode(df_n['degree'], '<f4'),
+            'names': list(df_n['p_name'].fillna('').astype(str))}
+
+
+def edge_payload(df_e, index, n):
+    '''
+    Party edges, with parallel moves aggregated into a weight and self loops
+    left out
+    '''
+    pairs = pd.DataFrame({'source': df_e['source'].map(index),
+                          'target': df_e['target'].map(index)}).dropna()
+    pairs = pairs.loc[pairs.source != pairs.target].astype(np.int64)
+    pairs = pairs.groupby(['source', 'target']).size(). \
+                  reset_index(name='weight')
+    dtype, array = index_dtype(n)
+
+    return {'type': array, 'count': len(pairs),
+            'source': encode(pairs['source'], dtype),
+            'target': encode(pairs['target'], dtype),
+            'weight': encode(pairs['weight'].clip(upper=2 ** 16 - 1), '<u2')}
+
+
+def cluster_payload(df_n):
+    '''
+    Positions, labels and size of the clusters, and the aggregated cluster
+    edges of com_network
+    '''
+    coms = df_n.groupby('clusters').agg(x=('clu_x', 'mean'),
+                                        y=('clu_y', 'mean'),
+                                        size=('node', 'size'),
+                                        label=('cluster_labs', 'first'))
+
+    conn = sqlite3.connect(db.db_file)
+    df_ec = pd.read_sql_query(q.com_network, conn)
+    conn.close()
+
+    df_ec = df_ec.loc[(df_ec.source != df_ec.target) & \
+                      df_ec.source.isin(coms.index) & \
+                      df_ec.target.isin(coms.index)]
+    position = pd.Series(np.arange(len(coms)), index=coms.index)
+
+    return {'id': [int(c) for c in coms.index],
+            'x': encode(coms['x'], '<f4'),
+            'y': encode(coms['y'], '<f4'),
+            'size': encode(coms['size'], '<f4'),
+            'labels': list(coms['label'].fillna('').astype(str)),
+            'source': encode(df_ec['source'].map(position), '<u2'),
+            'target': encode(df_ec['target'].map(position), '<u2'),
+            'weight': encode(df_ec['weight'], '<f4')}
+
+#  ________________________________________
+# |                                        |
+# |              5: Template               |
+# |________________________________________|
+
+HTML_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+  html, body {margin: 0; height: 100%; overflow: hidden;
+              font-family: sans-serif; background: #fff;}
+  canvas {display: block;}
+  #info {position: absolute; left: 10px; top: 10px; font-size: 13px;
+         background: rgba(255, 255, 255, 0.8); padding: 4px 8px;}
+</style>
+</head>
+<body>
+<div id="info"></div>
+<canvas id="net"></canvas>
+<script id="meta" type="application/json">__META__</script>
+<script id="edges" type="application/json">__EDGES__</script>
+<script>
+(function () {
+  var meta = JSON.parse(document.getElementById('meta').textContent);
+  var LOD = meta.lod_zoom;
+
+  function decode(b64, Type) {
+    var raw = atob(b64), bytes = new Uint8Array(raw.length);
+    for (var i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+    return new Type(bytes.buffer);
+  }
+
+  var N = {x: decode(meta.nodes.x, Float32Array),
+           y: decode(meta.nodes.y, Float32Array),
+           c: decode(meta.nodes.cluster, Uint16Array),
+           d: decode(meta.nodes.degree, Float32Array)};
+  var C = {x: decode(meta.clusters.x, Float32Array),
+           y: decode(meta.clusters.y, Float32Array),
+           size: decode(meta.clusters.size, Float32Array),
+           s: decode(meta.clusters.source, Uint16Array),
+           t: decode(meta.clusters.target, Uint16Array),
+           w: decode(meta.clusters.weight, Float32Array)};
+  var E = null; // Party edges, decoded on the first zoom in
+  var colorOf = {};
+  meta.clusters.id.forEach(function (id, i) {colorOf[id] = meta.colors[i];});
+  var maxW = Math.max.apply(null, Array.prototype.slice.call(C.w).concat([1]));
+
+  var canvas = document.getElementById('net'), ctx = canvas.getContext('2d');
+  var info = document.getElementById('info');
+  var view = {k: 1, x: 0, y: 0}, base = {k: 1, x: 0, y: 0}, pending = false;
+
+  function fit() {
+    canvas.width = window.innerWidth; canvas.height = window.innerHeight;
+    var x0 = Infinity, x1 = -Infinity, y0 = Infinity, y1 = -Infinity;
+    for (var i = 0; i < N.x.length; i++) {
+      x0 = Math.min(x0, N.x[i]); x1 = Math.max(x1, N.x[i]);
+      y0 = Math.min(y0, N.y[i]); y1 = Math.max(y1, N.y[i]);
+    }
+    var k = 0.9 * Math.min(canvas.width / Math.max(x1 - x0, 1e-9),
+                           canvas.height / Math.max(y1 - y0, 1e-9));
+    base = {k: k, x: canvas.width / 2 - k * (x0 + x1) / 2,
+            y: canvas.height / 2 + k * (y0 + y1) / 2};
+    draw();
+  }
+
+  function sx(x) {return view.x + view.k * (base.x + base.k * x);}
+  function sy(y) {return view.y + view.k * (base.y - base.k * y);}
+
+  function partyEdges() {
+    if (E === null) {
+      var raw = JSON.parse(document.getElementById('edges').textContent);
+      var Type = window[raw.type];
+      E = {s: decode(raw.source, Type), t: decode(raw.target, Type),
+           w: decode(raw.weight, Uint16Array)};
+    }
+    return E;
+  }
+
+  function draw() {
+    pending = false;
+    var W = canvas.width, H = canvas.height, i, a, b;
+    ctx.clearRect(0, 0, W, H);
+    var detail = view.k >= LOD;
+
+    if (detail) {
+      var e = partyEdges(), X = new Float32Array(N.x.length),
+          Y = new Float32Array(N.x.length);
+      for (i = 0; i < N.x.length; i++) {X[i] = sx(N.x[i]); Y[i] = sy(N.y[i]);}
+      ctx.strokeStyle = 'rgba(0, 0, 0, 0.15)'; ctx.lineWidth = 1;
+      ctx.beginPath();
+      for (i = 0; i < e.s.length; i++) {
+        a = e.s[i]; b = e.t[i];
+        if ((X[a] < 0 && X[b] < 0) || (X[a] > W && X[b] > W) ||
+            (Y[a] < 0 && Y[b] < 0) || (Y[a] > H && Y[b] > H)) continue;
+        ctx.moveTo(X[a], Y[a]); ctx.lineTo(X[b], Y[b]);
+      }
+      ctx.stroke();
+    } else {
+      for (i = 0; i < C.s.length; i++) {
+        a = C.s[i]; b = C.t[i];
+        ctx.strokeStyle = 'rgba(0, 0, 0, 0.25)';
+        ctx.lineWidth = 1 + 15 * Math.sqrt(C.w[i] / maxW);
+        ctx.beginPath();
+        ctx.moveTo(sx(C.x[a]), sy(C.y[a])); ctx.lineTo(sx(C.x[b]), sy(C.y[b]));
+        ctx.stroke();
+      }
+    }
+
+    ctx.globalAlpha = detail ? 0.9 : 0.4;
+    for (i = 0; i < N.x.length; i++) {
+      var px = sx(N.x[i]), py = sy(N.y[i]);
+      if (px < -10 || px > W + 10 || py < -10 || py > H + 10) continue;
+      var r = Math.max(1.5, Math.sqrt(N.d[i]) * Math.min(view.k, 4) / 2);
+      ctx.fillStyle = colorOf[N.c[i]] || '#888';
+      ctx.beginPath(); ctx.arc(px, py, r, 0, 2 * Math.PI); ctx.fill();
+      if (view.k >= 2 * LOD) {
+        ctx.fillStyle = '#000'; ctx.fillText(meta.nodes.names[i], px + r + 2, py);
+      }
+    }
+    ctx.globalAlpha = 1;
+
+    if (!detail) {
+      ctx.font = '13px sans-serif'; ctx.fillStyle = '#000';
+      for (i = 0; i < C.x.length; i++)
+        ctx.fillText(meta.clusters.labels[i], sx(C.x[i]), sy(C.y[i]));
+    }
+    info.textContent = meta.title + ' | ' + (detail ?
+      meta.edge_count + ' party edges' :
+      C.s.length + ' cluster edges (zoom in for party edges)');
+  }
+
+  function redraw() {
+    if (!pending) {pending = true; window.requestAnimationFrame(draw);}
+  }
+
+  canvas.addEventListener('wheel', function (ev) {
+    ev.preventDefault();
+    var f = Math.exp(-ev.deltaY * 0.0015);
+    view.x = ev.clientX - f * (ev.clientX - view.x);
+    view.y = ev.clientY - f * (ev.clientY - view.y);
+    view.k *= f;
+    redraw();
+  }, {passive: false});
+
+  var drag = null;
+  canvas.addEventListener('mousedown', function (ev) {
+    drag = {x: ev.clientX - view.x, y: ev.clientY - view.y};
+  });
+  window.addEventListener('mouseup', function () {drag = null;});
+  window.addEventListener('mousemove', function (ev) {
+    if (drag) {view.x = ev.clientX - drag.x; view.y = ev.clientY - drag.y;
+               redraw();}
+  });
+  window.addEventListener('resize', fit);
+  fit();
+})();
+</script>
+</body>
+</html>
+'''
+
+#  ________________________________________
+# |                                        |
+# |               6: Export                |
+# |________________________________________|
+
+def network_html(file=HTML_FILE, lod_zoom=LOD_ZOOM):
+    '''
+    Writes the interactive level of detail page of the full network
+
+    Input:
+        file: (str) path of the HTML page
+        lod_zoom: (float) zoom from which the party edges are drawn
+    Output:
+        file: (str) path of the HTML page
+    '''
+    DG, df_e, df_n = ns.network_structure(db.db_file, q.all_network, \
+                                          q.all_nodes, graph = nx.DiGraph)
+    df_n = df_n.reset_index()
+    index = pd.Series(np.arange(len(df_n)), index=df_n['node'])
+
+    clusters = cluster_payload(df_n)
+    edges = edge_payload(df_e, index, len(df_n))
+    meta = {'title': 'Party Switchers Network: {} parties, {} candidates, '
+                     '{} moves'.format(nx.number_of_nodes(DG),
+                                       df_e['id_hdv'].nunique(), len(df_e)),
+            'lod_zoom': lod_zoom,
+            'edge_count': edges['count'],
+            'nodes': node_payload(df_n),
+            'clusters': clusters,
+            'colors': colors(len(clusters['id']))}
+
+    # '</' cannot appear inside a script element
+    page = HTML_TEMPLATE.replace('__TITLE__', meta['title']). \
+               replace('__META__', json.dumps(meta).replace('</', '<\\/')). \
+               replace('__EDGES__', json.dumps(edges))
+
+    folder = os.path.dirname(file)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(file, 'w', encoding='utf-8') as f:
+        f.write(page)
+
+    return file
@@ -26,6 +26,9 @@ import matplotlib.pyplot as plt
 import matplotlib
 import os, sys
 import sqlite3
+import multiprocessing as mp
+import hashlib
+import time
 
 #  ________________________________________
 # |                                        |
@@ -36,6 +39,8 @@ import queries as q
 import db_config as db
 import network_structure as ns 
 import party_switching as ps
+import gen_clusters as gen
+import force_layout as fl
 
 #  ________________________________________
 # |                                        |
@@ -45,12 +50,245 @@ import party_switching as ps
 os.chdir(ps.wd)
 sys.path.append(os.chdir(ps.wd))
 
+#Globals
+LAYOUT_SEED = 1234 #Seed of the spring layouts
+LAYOUT_ENGINE = 'spring' #'spring' (nx.spring_layout) or 'barnes_hut'
+LAYOUT_CACHE = 'data/db/layout_cache.db' #Kept apart from db_config rebuilds
+LAYOUT_CACHE_SIZE = 10 #Number of layouts kept in the cache
+WARM_ITERATIONS = 10 #Refinement iterations of a warm started layout
+WARM_TEMPERATURE = 0.02 #Initial Barnes-Hut step of a warm start
+
 #  ________________________________________
 # |                                        |
 # |            4: Helper Functions         |
 # |________________________________________|
 
-def create_coordinates():
+def layout(G, engine=LAYOUT_ENGINE, timing=None, pos=None, **kwargs):
+    '''
+    Runs the selected layout engine with nx.spring_layout arguments. The
+    Barnes-Hut engine appends the seconds of every iteration to timing.
+    With pos (warm start), the Barnes-Hut steps start small.
+    '''
+    if engine == 'barnes_hut':
+        if pos is not None:
+            kwargs['temperature'] = WARM_TEMPERATURE
+        return fl.barnes_hut_layout(G, timing=timing, pos=pos, **kwargs)
+
+    return nx.spring_layout(G, pos=pos, **kwargs)
+
+
+def warm_positions(G, previous, seed=LAYOUT_SEED):
+    '''
+    Initial positions from a previous layout. Nodes without a previous
+    position are placed at the mean of their placed neighbours (with a
+    small jitter), or at random inside the layout if they have none.
+    Input:
+        G: (nx.Graph) graph to lay out
+        previous: (pd.DataFrame) previous x, y positions indexed by node
+    Output:
+        pos: (dict) initial position of every node
+    '''
+    previous = previous.loc[previous.index.isin(list(G))]
+    pos = {v: np.array(xy) for v, xy in zip(previous.index,
+                                            previous.values.tolist())}
+    if not pos:
+        return None
+
+    rng = np.random.RandomState(seed)
+    coords = np.array(list(pos.values()))
+    lo, hi = coords.min(axis=0), coords.max(axis=0)
+    jitter = max((hi - lo).max(), 1e-3) * 0.02
+    missing = [v for v in G if v not in pos]
+    for _ in range(2): # Twice, so chains of new nodes find a neighbour
+        for v in missing:
+            placed = [pos[u] for u in nx.all_neighbors(G, v) if u in pos]
+            if placed:
+                pos[v] = np.mean(placed, axis=0) + rng.uniform(-jitter,
+                                                               jitter, 2)
+        missing = [v for v in missing if v not in pos]
+    for v in missing:
+        pos[v] = lo + rng.rand(2) * (hi - lo)
+
+    return pos
+
+
+def community_layout(task):
+    '''
+    Spring layout of the parties of one community (run in the pool workers)
+    Input:
+        task: (tuple) community subgraph, layout engine and previous
+              positions of its nodes (None for a cold start)
+    Output:
+        pd.DataFrame with the sub_x, sub_y coordinates indexed by node
+        timing: (list) seconds of every iteration (Barnes-Hut only)
+    '''
+    subgraph, engine, previous = task
+    timing = []
+    pos = None if previous is None else warm_positions(subgraph, previous)
+    iterations = 40 if pos is None else WARM_ITERATIONS
+    #Unweighted within the communities, weighted between them
+    sub_pos = layout(subgraph, engine, timing, pos, iterations=iterations,
+                     scale=0.50, weight=None, seed=LAYOUT_SEED)
+
+    return pd.DataFrame.from_dict(sub_pos, orient='index',
+                                  columns=['sub_x', 'sub_y']), timing
+
+
+def community_layouts(DG, clusters, processes=None, engine=LAYOUT_ENGINE,
+                      previous=None):
+    '''
+    Lays out every community subgraph independently in a process pool, the
+    largest communities first so the wall time follows the largest one.
+    Input:
+        DG: Full Directed Network
+        clusters: (pd.Series) community of every node
+        processes: (int) number of workers. Defaults to the number of CPUs,
+                   1 runs in this process
+        engine: (str) layout engine (see layout)
+        previous: (pd.DataFrame) previous sub_x, sub_y of the nodes, to
+                  warm start the layouts
+    Output:
+        pd.DataFrame with the sub_x, sub_y coordinates indexed by node
+        timing: (list) seconds of the iterations of every community
+    '''
+    groups = clusters.groupby(clusters).groups
+    subgraphs = sorted([DG.subgraph(list(nodes)).copy() \
+                        for nodes in groups.values()],
+                       key=len, reverse=True)
+    tasks = [(g, engine, None if previous is None else \
+              previous.loc[previous.index.isin(list(g))]) \
+             for g in subgraphs if len(g) > 0]
+    if processes is None:
+        processes = mp.cpu_count()
+    processes = min(processes, len(tasks))
+
+    if processes <= 1:
+        layouts = [community_layout(t) for t in tasks]
+    else:
+        with mp.Pool(processes) as pool:
+            layouts = pool.map(community_layout, tasks, chunksize=1)
+
+    if not layouts:
+        return pd.DataFrame(columns=['sub_x', 'sub_y']), []
+    return pd.concat([l[0] for l in layouts]), [l[1] for l in layouts]
+
+#  ________________________________________
+# |                                        |
+# |             5: Layout Cache            |
+# |________________________________________|
+
+def fingerprint(DG, coms, clusters, setting):
+    '''
+    Hash of everything the layout depends on: nodes, edges, communities,
+    community graph and layout setting
+    '''
+    edges = pd.DataFrame(list(DG.edges()), columns=['source', 'target'])
+    com_edges = pd.DataFrame([(u, v, d.get('weight', 1)) for u, v, d in \
+                              coms.edges(data=True)],
+                             columns=['source', 'target', 'weight'])
+    parts = [clusters.sort_index().reset_index(),
+             edges.sort_values(['source', 'target']),
+             com_edges.sort_values(['source', 'target'])]
+    h = hashlib.sha1(setting.encode())
+    for df in parts:
+        h.update(pd.util.hash_pandas_object(df.astype(str), index=False)\
+                 .values.tobytes())
+
+    return h.hexdigest()
+
+
+def read_cache(key=None, setting=None):
+    '''
+    Reads a cached layout by fingerprint, or the latest layout of a setting
+    Output:
+        com_pos: (pd.DataFrame) x, y of every community
+        sub_pos: (pd.DataFrame) sub_x, sub_y of every node
+        None if there is no such layout
+    '''
+    if not os.path.exists(LAYOUT_CACHE):
+        return None
+    conn = sqlite3.connect(LAYOUT_CACHE)
+    if key is None:
+        key = pd.read_sql('SELECT fingerprint FROM layout_cache WHERE '
+                          'setting = ? ORDER BY stamp DESC LIMIT 1', conn,
+                          params=(setting,))['fingerprint']
+        key = key.iloc[0] if len(key) else None
+    df = pd.read_sql('SELECT * FROM layout_cache WHERE fingerprint = ?',
+                     conn, params=(key,))
+    conn.close()
+    if df.empty:
+        return None
+
+    com_pos = df.groupby('cluster')[['clu_x', 'clu_y']].first()
+    com_pos.columns = ['x', 'y']
+    sub_pos = df.set_index('node')[['sub_x', 'sub_y']].dropna()
+
+    return com_pos, sub_pos
+
+
+def write_cache(key, setting, clusters, com_pos, sub_pos):
+    '''
+    Stores a layout under its fingerprint, keeping the LAYOUT_CACHE_SIZE
+    latest layouts
+    '''
+    df = pd.DataFrame({'node': clusters.index, 'cluster': clusters.values})
+    df = df.join(com_pos, on='cluster').join(sub_pos, on='node')
+    df = df.rename(columns={'x': 'clu_x', 'y': 'clu_y'})
+    df['fingerprint'] = key
+    df['setting'] = setting
+    df['stamp'] = time.time()
+
+    conn = sqlite3.connect(LAYOUT_CACHE)
+    df.to_sql('layout_cache', conn, if_exists = 'append', index = False)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_layout_cache ON '
+                 'layout_cache (fingerprint)')
+    conn.execute('DELETE FROM layout_cache WHERE fingerprint NOT IN '
+                 '(SELECT fingerprint FROM layout_cache GROUP BY fingerprint '
+                 'ORDER BY MAX(stamp) DESC LIMIT ?)', (LAYOUT_CACHE_SIZE,))
+    conn.commit()
+    conn.close()
+
+#  ________________________________________
+# |                                        |
+# |       6: Coordinates and DB Update     |
+# |________________________________________|
+
+def compute_layout(DG, coms, clusters, processes, engine, previous=None):
+    '''
+    Two-level layout: the community graph first, then every community in
+    the pool. With a previous layout, both levels start from the previous
+    positions and only run a few refinement iterations.
+    Output:
+        com_pos: (pd.DataFrame) x, y of every community
+        sub_pos: (pd.DataFrame) sub_x, sub_y of every node
+    '''
+    pos, prev_sub = None, None
+    if previous is not None:
+        pos = warm_positions(coms, previous[0])
+        prev_sub = previous[1]
+
+    com_timing = []
+    com_pos = layout(coms, engine, com_timing, pos, k=4,
+                     iterations=50 if pos is None else WARM_ITERATIONS,
+                     weight = 'weight', seed=LAYOUT_SEED)
+    com_pos = pd.DataFrame.from_dict(com_pos, orient='index',
+                                     columns=['x', 'y'])
+
+    # Community layouts in parallel
+    sub_pos, timing = community_layouts(DG, clusters, processes, engine,
+                                        prev_sub)
+
+    if engine == 'barnes_hut':
+        its = np.concatenate([com_timing] + timing)
+        print('Barnes-Hut layout: {} iterations, {:.1f} ms per iteration, '\
+              'largest community {:.2f}s'.format(len(its),
+              1000 * its.mean(), max([sum(t) for t in timing] or [0])))
+
+    return com_pos, sub_pos
+
+
+def create_coordinates(level=None, processes=None, engine=LAYOUT_ENGINE,
+                       cache=True):
     '''
     Computes the coordinates for the full network graph
     Procedure:
@@ -58,35 +296,55 @@ def create_coordinates():
         communities as nodes
         -For each community a spring layout is computed and added to the
         community coordinates.
+    Layouts are cached by fingerprint of the graph: an unchanged graph
+    reuses its layout, and a changed one is warm started from the latest
+    layout with the same setting, so the picture stays stable.
+    Input:
+        level: (int) level of the community hierarchy used to group the
+               nodes (see gen.community_levels). None uses the clusters
+        processes: (int) number of workers for the community layouts
+        engine: (str) 'spring' or 'barnes_hut' layout engine
+        cache: (bool) use and update the layout cache
     Output:
         df_n: Node dataframe with coordinates columns.
     '''
+    if level is None:
+        node_query, edge_query = q.com_nodes, q.com_network
+    else:
+        node_query = q.com_nodes_level.format(int(level))
+        edge_query = q.com_network_level.format(int(level))
     coms, _, df_nc = ns.simple_graph(db.db_file, \
-                                     q.com_nodes, \
-                                     q.com_network, \
+                                     node_query, \
+                                     edge_query, \
                                      nx.Graph)
-    com_pos = nx.spring_layout(coms, k=4,iterations=50, weight = 'weight')
 
     DG, _, df_n = ns.network_structure(db.db_file, q.all_network, \
                                        q.all_nodes, graph = nx.DiGraph)
 
-    df_n['clu_x'] = df_n['clusters'].apply(lambda x: com_pos[x][0])
-    df_n['clu_y'] = df_n['clusters'].apply(lambda x: com_pos[x][1])
-    df_n['ini_x'] = 0
-    df_n['ini_y'] = 0
-
-    for c in com_pos.keys():
-
-        com = list(df_n.loc[df_n.clusters == c].index)
+    if level is None:
+        clusters = df_n['clusters']
+    else:
+        clusters = gen.level_clusters(level).reindex(df_n.index)
 
-        subgraph = DG.subgraph(com)
-        sub_pos = nx.spring_layout(subgraph, iterations=40, scale=0.50)
-        
-        sub_pos_x = pd.Series({k: v[0] for k, v in sub_pos.items()})
-        sub_pos_y = pd.Series({k: v[1] for k, v in sub_pos.items()})
+    setting = '{}:{}'.format(engine, 'clusters' if level is None else level)
+    key = fingerprint(DG, coms, clusters, setting)
+    cached = read_cache(key) if cache else None
+    if cached is not None:
+        print('Layout loaded from cache')
+        com_pos, sub_pos = cached
+    else:
+        previous = read_cache(setting=setting) if cache else None
+        com_pos, sub_pos = compute_layout(DG, coms, clusters, processes,
+                                          engine, previous)
+        if cache:
+            write_cache(key, setting, clusters, com_pos, sub_pos)
 
-        df_n.loc[df_n.clusters == c, 'ini_x'] = df_n['clu_x'] + sub_pos_x
-        df_n.loc[df_n.clusters == c, 'ini_y'] = df_n['clu_y'] + sub_pos_y
+    # Merged in one vectorized update
+    df_n['clu_x'] = clusters.map(com_pos['x'])
+    df_n['clu_y'] = clusters.map(com_pos['y'])
+    sub_pos = sub_pos.reindex(df_n.index)
+    df_n['ini_x'] = df_n['clu_x'] + sub_pos['sub_x']
+    df_n['ini_y'] = df_n['clu_y'] + sub_pos['sub_y']
 
     return df_n
 
@@ -97,6 +355,32 @@ def update_db(df_n):
     '''
     conn = sqlite3.connect(db.db_file)
     df_n.to_sql('nodes', conn, if_exists = 'replace', index = True)
+    conn.close()
+    ns.invalidate_cache(db.db_file)
+
+
+def update_level_coordinates(df_n, level):
+    '''
+    Stores the coordinates laid out by a level of the community hierarchy
+    in the level_coordinates table, replacing the previous ones of the
+    level. The nodes table (clusters and their coordinates) is left as is.
+    '''
+    df_l = df_n[['clu_x', 'clu_y', 'ini_x', 'ini_y']].copy()
+    df_l.insert(0, 'cluster', gen.level_clusters(level).reindex(df_n.index))
+    df_l.insert(0, 'level', int(level))
+    df_l.index.name = 'node'
+
+    conn = sqlite3.connect(db.db_file)
+    tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table'",
+                         conn)['name'].tolist()
+    if 'level_coordinates' in tables:
+        conn.execute('DELETE FROM level_coordinates WHERE level = ?',
+                     (int(level),))
+    df_l.to_sql('level_coordinates', conn, if_exists = 'append', index = True)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_level_coordinates ON '
+                 'level_coordinates (level, node)')
+    conn.commit()
+    conn.close()
 
 
 def update_candidate_menu():
@@ -127,13 +411,19 @@ def update_candidate_menu():
 
 #  ________________________________________
 # |                                        |
-# |             5: Wrapper Function        |
+# |             7: Wrapper Function        |
 # |________________________________________|
 
-def nodes_coordinates():
+def nodes_coordinates(level=None, processes=None, engine=LAYOUT_ENGINE):
     '''
-    Updates the dabase with coordinates for the communities and parties.
+    Updates the dabase with coordinates for the communities and parties,
+    grouping the parties by the clusters (nodes table) or by a level of the
+    community hierarchy (level_coordinates table, see total_graph and
+    cluster_graph with level).
     '''
-    df_n = create_coordinates()
-    update_db(df_n)
+    df_n = create_coordinates(level, processes, engine)
+    if level is None:
+        update_db(df_n)
+    else:
+        update_level_coordinates(df_n, level)
     update_candidate_menu()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Rendering Mode                           |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Rendering setup shared by the visualizations. In headless mode the plots use
+the non interactive Agg backend, never open a window or a browser, and
+return the saved file path (or the image bytes when no file is given), so
+they can run on servers and inside worker pools. The style is applied once
+and every plot reuses its own figure across calls. Plots composed directly
+as pixels (see total_graph) are written as images without a figure.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import io
+import matplotlib.pyplot as plt
+try:
+    from matplotlib import _png #Direct PNG writer (matplotlib < 3.3)
+except ImportError:
+    _png = None
+
+#  ________________________________________
+# |                                        |
+# |               2: Globals               |
+# |________________________________________|
+
+HEADLESS = False
+STYLE = 'seaborn-paper'
+STYLE_SET = False
+PNG_COMPRESSION = 3 #zlib level of the images written from pixels
+
+#  ________________________________________
+# |                                        |
+# |           3: Rendering Mode            |
+# |________________________________________|
+
+def headless(on=True):
+    '''
+    Turns the headless mode on (Agg backend, nothing is shown) or off
+    '''
+    global HEADLESS
+    HEADLESS = on
+    if on:
+        plt.switch_backend('Agg')
+
+
+def set_style():
+    '''
+    Applies the plot style, only the first time it is called
+    '''
+    global STYLE_SET
+    if not STYLE_SET:
+        plt.style.use(STYLE)
+        STYLE_SET = True
+
+
+def figure(name, figsize=(12, 7), **kwargs):
+    '''
+    Empty figure for a plot, reusing the figure of the previous call with
+    the same name
+
+    Input:
+        name: (str) name of the plot
+        figsize: (tuple) figure size in inches
+        kwargs: passed to plt.figure (e.g. dpi)
+    Output:
+        fig: (plt.Figure) the cleared figure, made the current one
+    '''
+    set_style()
+    fig = plt.figure(num=name, figsize=figsize, clear=True, **kwargs)
+    fig.set_size_inches(figsize)
+    if 'dpi' in kwargs:
+        fig.set_dpi(kwargs['dpi'])
+
+    return fig
+
+
+def output(fig, file=None, dpi=100, fmt='PNG'):
+    '''
+    Saves the figure and, when not headless, shows it
+
+    Input:
+        fig: (plt.Figure) the figure
+        file: (str) path of the image. None to return the image bytes
+        dpi: (int) resolution
+        fmt: (str) image format
+    Output:
+        (str or bytes) the path of the image, or the image bytes
+    '''
+    if file is None:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, dpi=dpi)
+        rv = buffer.getvalue()
+    else:
+        fig.savefig(file, format=fmt, dpi=dpi)
+        rv = file
+
+    if not HEADLESS:
+        plt.show()
+
+    return rv
+
+
+def write_image(image, file=None, dpi=100, fmt='PNG'):
+    '''
+    Writes an image given as pixels. PNG images skip the row filters, which
+    take most of the encoding time of large images and barely reduce their
+    size.
+
+    Input:
+        image: (np.array) RGBA pixels, uint8
+        file: (str) path of the image. None to return the image bytes
+        dpi: (int) resolution stored in the image
+        fmt: (str) image format
+    Output:
+        (str or bytes) the path of the image, or the image bytes
+    '''
+    if fmt.upper() == 'PNG' and _png is not None:
+        rv = _png.write_png(image, None, dpi, compression=PNG_COMPRESSION,
+                            filter=_png.PNG_FILTER_NONE)
+    else:
+        buffer = io.BytesIO()
+        plt.imsave(buffer, image, format=fmt, dpi=dpi)
+        rv = buffer.getvalue()
+
+    if file is None:
+        return rv
+    with open(file, 'wb') as f:
+        f.write(rv)
+
+    return file
+
+
+def output_image(image, file=None, dpi=100, fmt='PNG'):
+    '''
+    Writes an image given as pixels (see write_image) and, when not
+    headless, shows it
+    '''
+    rv = write_image(image, file, dpi, fmt)
+
+    if not HEADLESS:
+        fig = figure('image', figsize=(image.shape[1] / dpi,
+                                       image.shape[0] / dpi))
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.imshow(image)
+        ax.set_axis_off()
+        plt.show()
+
+    return rv
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Batch Sankey Export                      |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Exports the Sankey diagram of every party of the Sankey menu by every
+attribute as standalone HTML pages, with an index page linking them. The
+flows of all the parties are read from the flow cube in a single query, and
+the diagrams are built and written in parallel. The pages share one local
+copy of plotly.js instead of inlining it in every file. A diagram that
+fails is recorded, with its error, in the results and the index page, and
+the rest of the batch goes on.
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import os, sys
+import time
+import random
+import html
+import sqlite3
+import multiprocessing as mp
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+#  ________________________________________
+# |                                        |
+# |            2: Local Modules            |
+# |________________________________________|
+
+import party_switching as ps
+import build_sankey as bs
+import queries as q
+import db_config as db
+
+#  ________________________________________
+# |                                        |
+# |               3: Settings              |
+# |________________________________________|
+
+os.chdir(ps.wd)
+sys.path.append(os.chdir(ps.wd))
+
+#Globals
+SANKEY_DIR = 'output/sankey'
+PLOTLY_JS = 'plotly.min.js' #Shared by the pages, next to them
+WORKER_DATA = None #Party indexer shared by the workers
+
+INDEX_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Party Switchers Sankey Diagrams</title>
+<style>
+  body {{font-family: sans-serif;}}
+  td, th {{padding: 4px 10px; border-bottom: 1px solid #ddd;}}
+  .failed {{color: #b00;}}
+</style>
+</head>
+<body>
+<h2>Party Switchers Sankey Diagrams</h2>
+<table>
+<tr><th>Party</th>{header}</tr>
+{rows}
+</table>
+</body>
+</html>
+'''
+
+#  ________________________________________
+# |                                        |
+# |           4: Helper Functions          |
+# |________________________________________|
+
+def sankey_file(party, attribute):
+    '''
+    Name of the page of a party and attribute
+    '''
+    return '{}_{}.html'.format(party, attribute if attribute else 'None')
+
+
+def sankey_tasks(parties, attributes, out_dir):
+    '''
+    Reads the flows of all the parties at once and splits them into one task
+    per party and attribute
+
+    Input:
+        parties: (list) party indexes
+        attributes: (list) attributes (None for no attribute)
+        out_dir: (str) output directory
+    Output:
+        tasks: (list) (party, attribute, flows, file) tuples
+        empty: (list) (party, attribute) without flows
+    '''
+    conn = sqlite3.connect(db.db_file)
+    flows = pd.read_sql(q.sankey_parties.format( \
+                        ', '.join(str(int(p)) for p in parties)), conn)
+    conn.close()
+
+    slices = dict(list(flows.groupby(['party', 'attribute'])))
+    tasks, empty = [], []
+    for party in parties:
+        for attribute in attributes:
+            key = (party, attribute if attribute else 'None')
+            if key not in slices:
+                empty.append((party, attribute))
+                continue
+            df = slices[key][['direction', 'counterpart', 'attr_value', \
+                              'count']].reset_index(drop=True)
+            tasks.append((party, attribute, df, os.path.join(out_dir, \
+                          sankey_file(party, attribute))))
+
+    return tasks, empty
+
+
+def index_cell(party, attribute, missing, failed):
+    '''
+    Cell of the index page of a party and attribute: a link to the diagram,
+    or why there is none
+    '''
+    if (party, attribute) in missing:
+        return '<td>no flows</td>'
+    if (party, attribute) in failed:
+        return '<td class="failed" title="{}">failed</td>'.format( \
+               html.escape(failed[(party, attribute)]))
+
+    return '<td><a href="{}">view</a></td>'.format(sankey_file(party,
+                                                               attribute))
+
+
+def index_page(parties, attributes, indexer, empty, failed, out_dir):
+    '''
+    Writes the index page, a table of parties by attributes linking to the
+    diagrams. failed maps the (party, attribute) of the diagrams that could
+    not be built to their error.
+    '''
+    missing = set(empty)
+    header = ''.join('<th>{}</th>'.format(bs.VAR_LABELS[a]) \
+                     for a in attributes)
+    rows = []
+    for party in parties:
+        cells = [index_cell(party, a, missing, failed) for a in attributes]
+        rows.append('<tr><td>{}</td>{}</tr>'.format(indexer[party], \
+                                                   ''.join(cells)))
+
+    file = os.path.join(out_dir, 'index.html')
+    with open(file, 'w', encoding='utf-8') as f:
+        f.write(INDEX_TEMPLATE.format(header=header, rows='\n'.join(rows)))
+
+    return file
+
+#  ________________________________________
+# |                                        |
+# |              5: Workers                |
+# |________________________________________|
+
+def init_worker(indexer):
+    '''
+    Receives the party indexer once per worker
+    '''
+    global WORKER_DATA
+    WORKER_DATA = indexer
+
+
+def render_sankey(task):
+    '''
+    Builds and writes the page of one party and attribute, loading the
+    shared plotly.js. Colors are seeded by party and attribute, so the pages
+    are the same in every run. A failure is returned as the error of the
+    task (without file), so that it does not stop the batch.
+    '''
+    indexer = WORKER_DATA
+    party, attribute, df, file = task
+
+    start = time.time()
+    try:
+        random.seed('{}_{}'.format(party, attribute))
+        sankey_df = bs.clean_df(df.copy(), party, indexer, attribute)
+        sankey = bs.Sankey(sankey_df, attribute, indexer[party])
+        sankey.figure().write_html(file, include_plotlyjs=PLOTLY_JS, \
+                                   auto_open=False)
+    except Exception as e:
+        return party, attribute, None, 0, time.time() - start, \
+               '{}: {}'.format(type(e).__name__, e)
+
+    return party, attribute, file, os.path.getsize(file), \
+           time.time() - start, None
+
+#  ________________________________________
+# |                                        |
+# |               6: Export                |
+# |________________________________________|
+
+def export_sankeys(parties=None, attributes=None, out_dir=SANKEY_DIR,
+                   processes=None):
+    '''
+    Exports the Sankey diagrams of the parties by the attributes
+
+    Input:
+        parties: (list) party indexes. Defaults to the parties of the Sankey
+                 menu (SANKEY_PARTY_OPTIONS)
+        attributes: (list) attributes, None for no attribute. Defaults to
+                    every attribute of the Sankey menu (SANKEY_VARS)
+        out_dir: (str) output directory
+        processes: (int) number of workers. Defaults to the number of CPUs,
+                   1 runs in this process
+    Output:
+        results: (pd.DataFrame) party, attribute, file, bytes, seconds and
+                 error (None when the page was written) of every diagram
+    '''
+    start = time.time()
+    os.makedirs(out_dir, exist_ok=True)
+
+    indexer = bs.gen_party_indexer(db.db_file)
+    if parties is None:
+        parties = [k for k, v in indexer.items() \
+                   if v in ps.SANKEY_PARTY_OPTIONS]
+    if attributes is None:
+        attributes = [None if v == 'None' else v \
+                      for v in ps.SANKEY_VARS.values()]
+
+    tasks, empty = sankey_tasks(parties, attributes, out_dir)
+
+    plotly_js = os.path.join(out_dir, PLOTLY_JS)
+    with open(plotly_js, 'w', encoding='utf-8') as f:
+        f.write(get_plotlyjs())
+
+    if processes is None:
+        processes = mp.cpu_count()
+
+    if processes <= 1 or len(tasks) <= 1:
+        init_worker(indexer)
+        results = [render_sankey(t) for t in tasks]
+    else:
+        with mp.Pool(processes, initializer=init_worker,
+                     initargs=(indexer,)) as pool:
+            results = pool.map(render_sankey, tasks)
+
+    results = pd.DataFrame(results, columns=['party', 'attribute', 'file',
+                                             'bytes', 'seconds', 'error'])
+    failed = results.dropna(subset=['error'])
+    errors = dict(zip(zip(failed['party'], failed['attribute']),
+                      failed['error']))
+    index = index_page(parties, attributes, indexer, empty, errors, out_dir)
+
+    shared = os.path.getsize(plotly_js)
+    print('Exported {} Sankey diagrams in {:.1f}s, {} without flows, {} '
+          'failed. Index: {}'.format(len(results) - len(failed),
+                                     time.time() - start, len(empty),
+                                     len(failed), index))
+    for (party, attribute), error in errors.items():
+        print('  {} x {}: {}'.format(indexer[party], bs.VAR_LABELS[attribute],
+                                     error))
+    print('Output size: {:.1f} MB ({:.1f} MB with plotly.js inlined in '
+          'every page)'.format((results['bytes'].sum() + shared) / 1e6,
+                               (results['bytes'].sum() + shared * \
+                                (len(results) - len(failed))) / 1e6))
+
+    return results
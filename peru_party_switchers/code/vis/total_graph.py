@@ -20,6 +20,8 @@ import pydot
 import seaborn as sb
 import matplotlib.pyplot as plt
 import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import os, sys
 import sqlite3
 
@@ -32,6 +34,7 @@ import queries as q
 import db_config as db
 import network_structure as ns 
 import party_switching as ps 
+import render
 
 #  ________________________________________
 # |                                        |
@@ -41,6 +44,11 @@ import party_switching as ps
 os.chdir(ps.wd)
 sys.path.append(os.chdir(ps.wd))
 
+#Globals
+BASE_DPI = 500 #Resolution of the candidate graph and of its background
+BASE_CACHE = {} #Candidate graph background by database version and dpi
+BLIT_LAYER = {} #Canvas holding the background, built once per process
+
 #  ________________________________________
 # |                                        |
 # |             3: Helper Functions        |
@@ -65,6 +73,38 @@ def fetch_candidate(dist_id, party_id, cand_id):
     return tuple(rv)
 
 
+def format_trajectory(moves):
+    '''
+    Formats the moves (year, p_name and type) of a candidate as a string
+    ready for display
+    '''
+    moves = moves.copy()
+    moves.loc[moves.type == 'current', 'year'] = 2020
+    moves = moves.sort_values('year')
+    
+    return '\n'.join(['{}: {} ({})'.format(y,p,t) for y, p, t \
+                      in moves[['year', 'p_name', 'type']]. \
+                         itertuples(index = False, name=None)])
+
+
+def level_coordinates(level):
+    '''
+    Cluster and coordinates of every party laid out by a level of the
+    community hierarchy (see nodes_coordinates), None if that level has not
+    been laid out
+    '''
+    conn = sqlite3.connect(db.db_file)
+    tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table'",
+                         conn)['name'].tolist()
+    df_l = None
+    if 'level_coordinates' in tables:
+        df_l = pd.read_sql(q.level_coords.format(int(level)), conn)
+        df_l = df_l.set_index('node') if len(df_l) else None
+    conn.close()
+
+    return df_l
+
+
 def get_trajectory(id_hdv):
     '''
     Retrieves the candidate party switching trajectory in a string format
@@ -77,13 +117,9 @@ def get_trajectory(id_hdv):
     n_cursor = c.execute(query)
     header = ns.get_header(c)
     moves = pd.DataFrame(n_cursor.fetchall(), columns=header)
-    moves.loc[moves.type == 'current', 'year'] = 2020
-    moves = moves.sort_values('year')
-    
-    path = '\n'.join(['{}: {} ({})'.format(y,p,t) for y, p, t \
-                      in moves.itertuples(index = False, name=None)])
     conn.close()
-    return path     
+
+    return format_trajectory(moves)
 
 
 #  ________________________________________
@@ -91,18 +127,34 @@ def get_trajectory(id_hdv):
 # |             4: Graph Functions         |
 # |________________________________________|
 
-def total_graph(pos_only=False):
+def total_graph(pos_only=False, level=None, file="output/total_graph.png"):
     '''
-    Creates the full netowrk graph coloring the nodes by community
+    Creates the full netowrk graph coloring the nodes by community.
+    With level, the nodes are colored and placed by a level of the community
+    hierarchy, as laid out by nodes_coordinates(level).
+    Output:
+        (str or bytes) the path of the image, or its bytes if file is None
     '''
     DG, df_e, df_n = ns.network_structure(db.db_file, q.all_network, \
                                           q.all_nodes, graph = nx.DiGraph)
 
+    if level is not None:
+        df_l = level_coordinates(level)
+        if df_l is None:
+            raise ValueError('Level {} has not been laid out, run '
+                             'nodes_coordinates(level={})'.format(level,
+                                                                  level))
+        df_l = df_l.reindex(df_n.index)
+        df_n[['clusters', 'ini_x', 'ini_y']] = \
+            df_l[['cluster', 'ini_x', 'ini_y']]
+        df_n['cluster_labs'] = 'Community ' + \
+                               (df_n['clusters'] + 1).astype(str)
+
     pos = {n :(df_n.loc[n,'ini_x'], df_n.loc[n,'ini_y']) for n in df_n.index}
 
     ##Set plt and style
-    plt.style.use('seaborn-paper')
-    fig, ax = plt.subplots(1, 1, figsize=(12, 7)) 
+    fig = render.figure('total_graph')
+    ax = fig.add_subplot(1, 1, 1)
 
     ## Position type, nodes, edges and labels
 
@@ -111,14 +163,15 @@ def total_graph(pos_only=False):
     from_list = matplotlib.colors.LinearSegmentedColormap.from_list 
     cm = from_list(None, plt.cm.tab20(range(0,n)), n)
 
-    ec = nx.draw_networkx_edges(DG, pos, alpha=0.05)
+    ec = nx.draw_networkx_edges(DG, pos, alpha=0.05, ax=ax)
     nc = nx.draw_networkx_nodes(DG, pos, nodelist=DG.nodes(),
                                 node_color=list(df_n['clusters']), 
                                 alpha=0.8, 
                                 node_size=list(df_n['degree']*5), 
                                 cmap=cm,
                                 vmin = -0.5,
-                                vmax = n - 0.5)
+                                vmax = n - 0.5,
+                                ax=ax)
 
     ##Groups colorbar
     df_n = df_n.sort_values(by = ['clusters', 'degree', 'node']) 
@@ -131,45 +184,68 @@ def total_graph(pos_only=False):
     cbar.ax.set_yticklabels(list(df_n['cluster_labs'].unique()))
 
     ##Title, annotations and labels
-    ax.set_title('Party Switchers Network and Clusters by Greedy Modularity*', \
-                  fontsize=15, ha='center')
+    if level is None:
+        title = 'Party Switchers Network and Clusters by Greedy Modularity*'
+        note = '\n \
+    *The biggest cluster was diveded using Kernighan Lin bisection: \n\
+    Strong Regional Left and Socialist Progressive + AP'
+    else:
+        title = 'Party Switchers Network and Communities (Level {})'.\
+                format(level)
+        note = ''
+    ax.set_title(title, fontsize=15, ha='center')
 
     plt.annotate('    Note: Composed Spring Layout. \n\
     Network with {} parties (nodes) and {} \
     candidates (edges) \n\
-    Node size proportional to its degree (adjacent edges) \n \
-    *The biggest cluster was diveded using Kernighan Lin bisection: \n\
-    Strong Regional Left and Socialist Progressive + AP'. 
-                 format(nx.number_of_nodes(DG), nx.number_of_edges(DG)), \
+    Node size proportional to its degree (adjacent edges) {}'. 
+                 format(nx.number_of_nodes(DG), nx.number_of_edges(DG),
+                        note), \
                  (0,0), (0, -10), xycoords='axes fraction', \
                  textcoords='offset points', va='top')
     ax.yaxis.set_label_position("right")
     ax.set_ylabel('Party Clusters', size=10)
     
     ##Save as image 
-    plt.savefig("output/total_graph.png", format="PNG", dpi=500)
-    plt.show()
+    return render.output(fig, file, dpi=500)
 
 
-def cluster_graph(k=4, pos_only = False):
+def cluster_graph(k=4, pos_only = False, level=None,
+                  file="output/cluster_graph.png"):
     '''
-    Creates the community level netowrk graph coloring the nodes by community
+    Creates the community level netowrk graph coloring the nodes by community.
+    With level, the communities are a level of the community hierarchy (see
+    gen_clusters.community_levels), at the positions of
+    nodes_coordinates(level) or, if it has not been laid out, with a spring
+    layout.
+    Output:
+        (str or bytes) the path of the image, or its bytes if file is None
     '''
+    laid_out = level is None or level_coordinates(level) is not None
+    if level is None:
+        node_query, edge_query = q.com_nodes_coords, q.com_network
+    elif laid_out:
+        node_query = q.com_nodes_level_coords.format(int(level))
+        edge_query = q.com_network_level.format(int(level))
+    else:
+        node_query = q.com_nodes_level.format(int(level))
+        edge_query = q.com_network_level.format(int(level))
     coms, df_ec, df_nc = ns.simple_graph(db.db_file, \
-                                         q.com_nodes_coords, \
-                                         q.com_network, \
+                                         node_query, \
+                                         edge_query, \
                                          nx.Graph)
 
     df_nc['degree'] = pd.Series(dict(coms.degree(weight = 'weight')))
 
+    if laid_out:
+        pos = {n :(df_nc.loc[n,'clu_x'], df_nc.loc[n,'clu_y']) for n in df_nc.index}
+    else:
+        pos = nx.spring_layout(coms, k=k, iterations=50, weight='weight',
+                               seed=1234)
 
-    pos = {n :(df_nc.loc[n,'clu_x'], df_nc.loc[n,'clu_y']) for n in df_nc.index}
-
-    plt.close()
-    
     ##Set plt and style
-    plt.style.use('seaborn-paper')
-    fig, ax = plt.subplots(1, 1, figsize=(12, 7)) 
+    fig = render.figure('cluster_graph')
+    ax = fig.add_subplot(1, 1, 1)
 
     ## Position type, nodes, edges and labels
      # alternative: spring_layout 
@@ -179,14 +255,16 @@ def cluster_graph(k=4, pos_only = False):
     from_list = matplotlib.colors.LinearSegmentedColormap.from_list 
     cm = from_list(None, plt.cm.tab20(range(0,n)), n)
 
-    ec = nx.draw_networkx_edges(coms, pos, width = widths, alpha = 0.1 )
+    ec = nx.draw_networkx_edges(coms, pos, width = widths, alpha = 0.1,
+                                ax=ax)
     nc = nx.draw_networkx_nodes(coms, pos, nodelist=coms.nodes(),
                                 node_color=list(df_nc.index), 
                                 alpha=0.6, 
                                 node_size=list(df_nc['degree']*30), 
                                 cmap=cm,
                                 vmin = -0.5,
-                                vmax= n-0.5)
+                                vmax= n-0.5,
+                                ax=ax)
 
     ##Groups colorbar
 
@@ -213,33 +291,23 @@ def cluster_graph(k=4, pos_only = False):
     ax.set_ylabel('Party Clusters', size=10)
     
     ##Save as image 
-    plt.savefig("output/cluster_graph.png", format="PNG", dpi=499)
-    plt.show()
-    return
+    return render.output(fig, file, dpi=499)
 
 
-def candidate_graph(dist_id, party_id, cand_id):
+def render_base(DG, df_n, dpi=BASE_DPI):
     '''
-    Highlights a particular candidate in the full network graph 
+    Renders the background of the candidate graph (full network edges,
+    faded community nodes and colorbar) once, as a raster image at the
+    resolution of the output
+    Output:
+        base: (dict) the image, its resolution, the position of the plot
+              axes inside the figure, its limits and the node positions
     '''
-    id_hdv, name = fetch_candidate(dist_id, party_id, cand_id)
-
-    DG, df_e, df_n = ns.network_structure(db.db_file, q.all_network, \
-                                          q.all_nodes, graph = nx.DiGraph)
-
-    cand_nodes = set(df_e.loc[df_e.id_hdv == id_hdv, 'source'].unique()) | \
-                 set(df_e.loc[df_e.id_hdv == id_hdv, 'target'].unique())
-
-    cand_edges = list(df_e.loc[df_e.id_hdv == id_hdv, \
-                               ['source','target']].itertuples(index=False, \
-                                                               name=None))    
-    path = get_trajectory(id_hdv)
-
     pos = {n :(df_n.loc[n,'ini_x'], df_n.loc[n,'ini_y']) for n in df_n.index}
 
     ##Set plt and style
-    plt.style.use('seaborn-paper')
-    fig, ax = plt.subplots(1, 1, figsize=(12, 7)) 
+    render.set_style()
+    fig, ax = plt.subplots(1, 1, figsize=(12, 7), dpi=dpi) 
     plt.subplots_adjust(bottom=0.20)
     ## Position type, nodes, edges and labels
 
@@ -248,40 +316,150 @@ def candidate_graph(dist_id, party_id, cand_id):
     from_list = matplotlib.colors.LinearSegmentedColormap.from_list 
     cm = from_list(None, plt.cm.tab20(range(0,n)), n)
 
-    ec = nx.draw_networkx_edges(DG, pos, alpha=0.05)
+    ec = nx.draw_networkx_edges(DG, pos, alpha=0.05, ax=ax)
     nc = nx.draw_networkx_nodes(DG, pos, nodelist=DG.nodes(),
                                 node_color=list(df_n['clusters']), 
                                 alpha=0.3, 
                                 node_size=list(df_n['degree']*5), 
                                 cmap=cm,
                                 vmin = -0.5,
-                                vmax = n - 0.5)
-
-
-    nx.draw_networkx_nodes(DG,pos,nodelist=list(cand_nodes),node_color='r', alpha = 0.8, node_size = 20)
-    nx.draw_networkx_edges(DG,pos,edgelist=cand_edges,edge_color='r',width=1, alpha = 0.8)
+                                vmax = n - 0.5,
+                                ax=ax)
 
     ##Groups colorbar
     df_n = df_n.sort_values(by = ['clusters', 'degree', 'node']) 
 
     cbar = fig.colorbar(nc, spacing='uniform', 
                         ticks=list(df_n['clusters'].unique()))
-    #ax.set_yticks(df_n['clusters'].unique() + 0.5, minor=False)
-
 
     cbar.ax.set_yticklabels(list(df_n['cluster_labs'].unique()))
 
-    ##Title, annotations and labels
-    ax.set_title('Political path of candidate {}'.format(name), \
-                  fontsize=15, ha='center')
-
-    plt.annotate('Trajectory: \n{}'.format(path), \
-                 (0,0), (0, -10), xycoords='axes fraction', \
-                 textcoords='offset points', va='top')
     ax.yaxis.set_label_position("right")
     ax.set_ylabel('Party Clusters', size=10)
-    
-    ##Save as image 
-    plt.savefig("output/total_graph.png", format="PNG", dpi=500)
-    plt.show()
 
+    fig.canvas.draw()
+    base = {'image': np.asarray(fig.canvas.buffer_rgba()).copy(),
+            'dpi': dpi,
+            'position': ax.get_position().bounds,
+            'xlim': ax.get_xlim(),
+            'ylim': ax.get_ylim(),
+            'pos': pos}
+    plt.close(fig)
+
+    return base
+
+
+def candidate_base(DG, df_n, dpi=BASE_DPI):
+    '''
+    Background of the candidate graph for the current layout, rendered only
+    when the database (and so the node coordinates) or the resolution
+    changes
+    '''
+    version = (ns.db_version(db.db_file), dpi)
+    if version not in BASE_CACHE:
+        BASE_CACHE.clear()
+        BASE_CACHE[version] = render_base(DG, df_n, dpi)
+
+    return BASE_CACHE[version]
+
+
+def blit_layer(base):
+    '''
+    Canvas of the candidate graph with the background drawn once, pixel for
+    pixel, and saved to be restored before every candidate. It is built in
+    every process that draws candidates, since canvases can not be shared.
+    Output:
+        (tuple) figure, canvas, plot axes and saved background
+    '''
+    if BLIT_LAYER.get('base') is not base:
+        height, width = base['image'].shape[:2]
+        fig = Figure(figsize=(width / base['dpi'], height / base['dpi']),
+                     dpi=base['dpi'])
+        canvas = FigureCanvasAgg(fig)
+        fig.figimage(base['image'])
+        ax = fig.add_axes(base['position'])
+        ax.set_axis_off()
+        ax.set_xlim(base['xlim'])
+        ax.set_ylim(base['ylim'])
+        canvas.draw()
+        BLIT_LAYER.clear()
+        BLIT_LAYER.update(base=base, layer=(fig, canvas, ax,
+                                            canvas.copy_from_bbox(fig.bbox)))
+
+    return BLIT_LAYER['layer']
+
+
+def candidate_image(base, cand_nodes, cand_edges, name, path):
+    '''
+    Draws the path of a candidate over the background of the candidate
+    graph. Only the candidate artists are drawn: the background pixels are
+    restored, not drawn again.
+    Input:
+        base: (dict) background from render_base
+        cand_nodes: (set) parties of the candidate
+        cand_edges: (list) (source, target) moves of the candidate
+        name: (str) candidate name
+        path: (str) trajectory, as in format_trajectory
+    Output:
+        image: (np.array) RGBA pixels of the graph, at the background dpi
+    '''
+    fig, canvas, ax, background = blit_layer(base)
+    canvas.restore_region(background)
+
+    pos = base['pos']
+    CG = nx.DiGraph()
+    CG.add_nodes_from(cand_nodes)
+    CG.add_edges_from(cand_edges)
+
+    ## Candidate path
+    nodes = nx.draw_networkx_nodes(CG,pos,nodelist=list(cand_nodes),node_color='r', alpha = 0.8, node_size = 20, ax=ax)
+    edges = nx.draw_networkx_edges(CG,pos,edgelist=cand_edges,edge_color='r',width=1, alpha = 0.8, ax=ax)
+    ax.set_xlim(base['xlim'])
+    ax.set_ylim(base['ylim'])
+
+    ##Title, annotations and labels
+    title = ax.set_title('Political path of candidate {}'.format(name), \
+                         fontsize=15, ha='center')
+
+    note = ax.annotate('Trajectory: \n{}'.format(path), \
+                       (0,0), (0, -10), xycoords='axes fraction', \
+                       textcoords='offset points', va='top')
+
+    # Directed edges are drawn as a list of arrows
+    artists = [a for a in [nodes, note] if a is not None] + list(edges or [])
+    for artist in artists + [title]:
+        ax.draw_artist(artist)
+    image = np.asarray(canvas.buffer_rgba()).copy()
+
+    for artist in artists:
+        artist.remove()
+    ax.set_title('')
+
+    return image
+
+
+def candidate_graph(dist_id, party_id, cand_id, file="output/total_graph.png"):
+    '''
+    Highlights a particular candidate in the full network graph. Only the
+    candidate path and annotations are drawn, over the cached background.
+    Output:
+        (str or bytes) the path of the image, or its bytes if file is None
+    '''
+    id_hdv, name = fetch_candidate(dist_id, party_id, cand_id)
+
+    DG, df_e, df_n = ns.network_structure(db.db_file, q.all_network, \
+                                          q.all_nodes, graph = nx.DiGraph)
+    base = candidate_base(DG, df_n)
+
+    cand_nodes = set(df_e.loc[df_e.id_hdv == id_hdv, 'source'].unique()) | \
+                 set(df_e.loc[df_e.id_hdv == id_hdv, 'target'].unique())
+
+    cand_edges = list(df_e.loc[df_e.id_hdv == id_hdv, \
+                               ['source','target']].itertuples(index=False, \
+                                                               name=None))    
+    path = get_trajectory(id_hdv)
+
+    image = candidate_image(base, cand_nodes, cand_edges, name, path)
+
+    ##Save as image 
+    return render.output_image(image, file, dpi=base['dpi'])
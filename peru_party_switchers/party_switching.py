@@ -110,7 +110,8 @@ Please select the centrality measure by which to order the nodes.
 (2) Out Degree
 (3) Betweeness Centrality
 (4) Eigenvector Centrality
-(5) Exit Back to Previous Menu
+(5) PageRank
+(6) Exit Back to Previous Menu
 '''
 
 CANDIDATE_DISTRICT_MENU = '''
@@ -135,7 +136,7 @@ Please select a candidate
 '''
 
 CENTRALITY_MEASURES = {1: "in_degree", 2: "out_degree", 3: "betweeness",
-                       4: "eigenvector"}
+                       4: "eigenvector", 5: "pagerank"}
 
 SANKEY_PARTY_OPTIONS = ["APRISTA PERUANO", "POPULAR CRISTIANO",
                         "NACIONALISTA", "ACCION POPULAR",
@@ -279,11 +280,11 @@ def network_metrics_options():
     print(NETWORK_METRICS_MENU)
     while True:
         option = int(input("Option: "))
-        if option < 1 or option > 5:
+        if option < 1 or option > 6:
             print("Invalid option. Please select an option from the menu.")
             print()
             continue
-        if option == 5:
+        if option == 6:
             return
         else:
             rv = CENTRALITY_MEASURES[option]
@@ -391,9 +392,11 @@ def candidate_menu_wrapper():
 # |            10: Main Function           |
 # |________________________________________|
 
-def main():
+def main(incremental=False):
     '''
-    Console based interface
+    Console based interface. With incremental, the clusters of the last full
+    clustering are refined where the network changed instead of being
+    recomputed (see gen_clusters).
     '''
 
     handler = {1: web_scrape_wrapper, 2: sankey_options_wrapper,
@@ -414,13 +417,18 @@ def main():
     print()
 
     sv.gen_sankey_vars(db.db_file)
+    sv.gen_flow_cube(db.db_file, SANKEY_VARS.values())
 
     print("Updating database with clusters...")
     print()
-    gen.gen_clusters()
+    gen.gen_clusters(incremental=incremental)
     print("Finished updating database with clusters")
     print()
 
+    print("Computing network metrics...")
+    print()
+    nm.gen_node_metrics()
+
     nc.nodes_coordinates()
     print("Pouring syrup")
 
@@ -433,4 +441,4 @@ def main():
 
 if __name__ == "__main__":
     # Access point for the application
-    main()
+    main(incremental='--incremental' in sys.argv[1:])
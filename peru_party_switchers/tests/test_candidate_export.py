@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+'''
+  __________________________________________
+ |                                          |
+ | Candidate Export Tests                   |
+ | Team: Party Switchers                    |
+ | Authors: Marc Richardson                 |
+ | Responsable: Marc Richardson             |
+ | Date: March, 2020                        |
+ |__________________________________________|
+
+ =============================================================================
+Tests of the candidate trajectory export: file names of the ids with
+slashes and failures of single candidates. Run from peru_party_switchers:
+    python -m pytest tests
+ =============================================================================
+'''
+#  ________________________________________
+# |                                        |
+# |              1: Libraries              |
+# |________________________________________|
+
+import os, sys
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+#  ________________________________________
+# |                                        |
+# |            2: Local Modules            |
+# |________________________________________|
+
+import party_switching
+import candidate_export as ce
+import total_graph as tg
+import db_config as db
+
+#  ________________________________________
+# |                                        |
+# |               3: Fixtures              |
+# |________________________________________|
+
+IDS = ['0-1-1', '2/1/2001', '2/10/1930']
+
+@pytest.fixture
+def candidates_db(tmp_path, monkeypatch):
+    '''
+    Database with the candidate_menu and edges tables of three candidates,
+    two of them with slashes in their id
+    '''
+    file = str(tmp_path / 'db.db')
+    conn = sqlite3.connect(file)
+    pd.DataFrame({'id_hdv': IDS, 'name': ['A', 'B', 'C']}) \
+      .to_sql('candidate_menu', conn, index=False)
+    pd.DataFrame({'id_hdv': IDS * 2, 'year': [2010] * 3 + [2014] * 3,
+                  'p_name': ['X'] * 3 + ['Y'] * 3, 'type': ['party'] * 6}) \
+      .to_sql('edges', conn, index=False)
+    conn.close()
+    monkeypatch.setattr(db, 'db_file', file)
+
+    return file
+
+
+@pytest.fixture
+def edges():
+    '''
+    Edges of the network of the three candidates
+    '''
+    return pd.DataFrame({'id_hdv': IDS, 'source': [1, 1, 2],
+                         'target': [2, 3, 3]})
+
+#  ________________________________________
+# |                                        |
+# |                4: Tests                |
+# |________________________________________|
+
+def test_image_name_flattens_slashes():
+    assert ce.image_name('2/1/2001') == '2-1-2001.png'
+    assert ce.image_name('0-1-1') == '0-1-1.png'
+    assert ce.image_name('2/1/2001', {'2-1-2001.png'}) == '2-1-2001_1.png'
+
+
+def test_tasks_of_ids_with_slashes(candidates_db, edges, tmp_path):
+    out_dir = str(tmp_path / 'out')
+    tasks, skipped = ce.candidate_tasks(edges, out_dir)
+
+    files = {t[0]: t[-1] for t in tasks}
+    assert skipped == 0
+    assert files['2/1/2001'] == os.path.join(out_dir, '2-1-2001.png')
+    assert all(os.path.dirname(f) == out_dir for f in files.values())
+
+
+def test_render_id_with_slash(candidates_db, edges, tmp_path, monkeypatch):
+    out_dir = str(tmp_path / 'out')
+    os.makedirs(out_dir)
+    image = np.zeros((10, 10, 4), dtype=np.uint8)
+    monkeypatch.setattr(tg, 'candidate_image', lambda *args: image)
+    ce.init_worker({'dpi': 100}, headless=False)
+
+    tasks, _ = ce.candidate_tasks(edges, out_dir)
+    results = [ce.render_candidate(t) for t in tasks]
+
+    assert all(error is None for _, _, _, error in results)
+    assert sorted(os.listdir(out_dir)) == ['0-1-1.png', '2-1-2001.png',
+                                           '2-10-1930.png']
+
+
+def test_failed_candidate_is_recorded(candidates_db, edges, tmp_path,
+                                      monkeypatch):
+    out_dir = str(tmp_path / 'out')
+    os.makedirs(out_dir)
+
+    def candidate_image(base, cand_nodes, cand_edges, name, path):
+        if name == 'B':
+            raise ValueError('no layout')
+        return np.zeros((10, 10, 4), dtype=np.uint8)
+
+    monkeypatch.setattr(tg, 'candidate_image', candidate_image)
+    ce.init_worker({'dpi': 100}, headless=False)
+
+    tasks, _ = ce.candidate_tasks(edges, out_dir)
+    results = {r[0]: r for r in map(ce.render_candidate, tasks)}
+
+    assert results['2/1/2001'][1] is None
+    assert results['2/1/2001'][3] == 'ValueError: no layout'
+    assert results['0-1-1'][3] is None
+    assert sorted(os.listdir(out_dir)) == ['0-1-1.png', '2-10-1930.png']